@@ -0,0 +1,300 @@
+# headless latency and throughput benchmarks for the name check app's hot paths
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import warnings
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.exceptions import ConvergenceWarning
+
+import charts
+import forecast
+import names_data
+from name_index import lookup
+from name_picker import NamePicker
+
+
+# where results go, one JSON file per run
+RESULTS_DIR = Path(__file__).parent / 'benchmarks'
+
+STAGES = ['startup', 'load', 'lookup', 'top', 'picker', 'forecast', 'charts']
+
+# the same names every run, so runs can be compared
+SEED = 0
+
+# what streamlit_app.py imports, timed with python -X importtime
+APP_IMPORTS = ['streamlit', 'charts', 'forecast', 'names_data', 'queries', 'timing',
+               'name_index', 'name_picker']
+
+# the slow third party packages, and whether the first run of the app needed them
+HEAVY_MODULES = ['sklearn', 'matplotlib']
+
+
+def summarise(seconds):
+    # latency percentiles in milliseconds, and how many calls a second that is
+    ms = 1000 * np.asarray(seconds)
+    return {
+        'n': len(ms),
+        'p50_ms': float(np.percentile(ms, 50)),
+        'p95_ms': float(np.percentile(ms, 95)),
+        'p99_ms': float(np.percentile(ms, 99)),
+        'mean_ms': float(ms.mean()),
+        'max_ms': float(ms.max()),
+        'per_second': float(1000 / ms.mean()) if ms.mean() > 0 else None,
+    }
+
+
+def timed(function, calls):
+    # time each call separately
+    seconds = []
+    for args in calls:
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+    return summarise(seconds)
+
+
+def sample_names(dataset, n, seed=SEED):
+    # a fixed sample of names, the same on every run over the same data
+    rng = np.random.default_rng(seed)
+    names = sorted(dataset.names)
+    return [names[i] for i in sorted(rng.choice(len(names), size=min(n, len(names)), replace=False))]
+
+
+###### stages ######
+
+def bench_load(key, source):
+    # a cold load in a fresh process, nothing cached
+    command = [sys.executable, __file__, '--load-child', key, source]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _load_child(key, source):
+    start = time.perf_counter()
+    dataset = names_data.load_dataset(key, source)
+    seconds = time.perf_counter() - start
+    print(json.dumps({'seconds': seconds, 'rows': len(dataset.frame), 'peak_rss_bytes': names_data.peak_rss()}))
+
+
+def bench_lookup(dataset, names):
+    # the rows for a name, then its statistics
+    return {
+        'rows': timed(lambda name: lookup(dataset, name), [(name,) for name in names]),
+        'stats': timed(dataset.matrix.name_stats, [(name,) for name in names]),
+        'missing': timed(lambda name: lookup(dataset, name), [(name + 'zz',) for name in names]),
+    }
+
+
+def bench_top(dataset):
+    # the top 10 of every year for both genders
+    calls = [(year, gender, 10) for year in range(dataset.first_year, dataset.latest_year + 1) for gender in 'FM']
+    return timed(dataset.top, calls)
+
+
+def bench_picker(dataset, picks=1000):
+    start = time.perf_counter()
+    picker = NamePicker(dataset)
+    build = time.perf_counter() - start
+
+    rng = np.random.default_rng(SEED)
+    return {
+        'build_ms': 1000 * build,
+        'pick': timed(lambda gender: picker.pick(gender, rng=rng), [('FM'[i % 2],) for i in range(picks)]),
+        'pick_filtered': timed(lambda gender: picker.pick(gender, weighted=True, band='Top 100', trend='rising', rng=rng),
+                               [('FM'[i % 2],) for i in range(picks)]),
+    }
+
+
+def bench_forecast(dataset, names):
+    # one fit per name with each engine, nothing cached, the accurate one warm started as in the app
+    results = {}
+    for engine in forecast.ENGINES.values():
+        if isinstance(engine, forecast.GPForecaster):
+            forecast.dataset_prior(dataset)
+        results[engine.name] = timed(lambda name: engine.forecast(lookup(dataset, name), 20, dataset.key, name),
+                                     [(name,) for name in names])
+    return results
+
+
+def bench_charts(dataset, names):
+    # a fresh render of each chart, then the same charts from the cache
+    series = [(name, lookup(dataset, name)) for name in names]
+    prediction = forecast.ENGINES['fast'].forecast
+    charts.chart_cache.clear()
+
+    return {
+        'history': timed(lambda name, name_data: charts.history_png(dataset.key, name, name_data), series),
+        'history_cached': timed(lambda name, name_data: charts.history_png(dataset.key, name, name_data), series),
+        'prediction': timed(lambda name, name_data: charts.prediction_png(
+            dataset.key, name, name_data, prediction(name_data), ('fast',)), series),
+        'series': timed(lambda name, name_data: charts.history_series(name_data), series),
+    }
+
+
+def import_times(modules=APP_IMPORTS):
+    """Cumulative import time of every package the app's imports pull in, in a fresh interpreter.
+
+    A package's time includes whatever it imports itself, so pandas
+    includes numpy. total_ms is the whole import line.
+    """
+    command = [sys.executable, '-X', 'importtime', '-c', f"import {', '.join(modules)}"]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=Path(__file__).parent)
+
+    packages, total = {}, 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        ms = int(cumulative) / 1000
+        # nested imports are indented under whatever imported them
+        if not module.startswith('  '):
+            total += ms
+        if '.' not in module.strip():
+            packages[module.strip()] = ms
+
+    slow = {package: ms for package, ms in packages.items() if ms >= 10 or package in modules}
+    return {'total_ms': total, **dict(sorted(slow.items(), key=lambda item: -item[1]))}
+
+
+# the app's first two runs in a fresh interpreter, timed from before streamlit is imported
+STARTUP_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file('streamlit_app.py', default_timeout=600)
+app.run()
+first = time.perf_counter() - start
+start = time.perf_counter()
+app.run()
+print(json.dumps({
+    'first_paint_seconds': first,
+    'rerun_seconds': time.perf_counter() - start,
+    'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    'imported': {module: module in sys.modules for module in %r},
+}))
+"""
+
+
+def bench_startup():
+    # import times, then what the first visitor to a freshly started server waits for
+    command = [sys.executable, '-c', STARTUP_SCRIPT % HEAVY_MODULES]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=Path(__file__).parent)
+    if result.returncode != 0:
+        return {'error': result.stderr.strip().splitlines()[-1]}
+    return {'import_ms': import_times(), **json.loads(result.stdout.strip().splitlines()[-1])}
+
+
+###### running and comparing ######
+
+def git_commit():
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                            cwd=Path(__file__).parent)
+    return result.stdout.strip() or None
+
+
+def run(keys, stages, names=200, fits=10, sources=('snapshot', 'csv')):
+    """Every stage for every dataset, as one dict ready to be written out as JSON."""
+    results = {
+        'meta': {
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'names': names,
+            'fits': fits,
+        },
+        'datasets': {},
+    }
+
+    if 'startup' in stages:
+        results['startup'] = bench_startup()
+
+    for key in keys:
+        out = results['datasets'][key] = {}
+        if 'load' in stages:
+            out['load'] = {source: bench_load(key, source) for source in sources}
+
+        dataset = names_data.load_dataset(key)
+        sample = sample_names(dataset, names)
+        if 'lookup' in stages:
+            out['lookup'] = bench_lookup(dataset, sample)
+        if 'top' in stages:
+            out['top'] = bench_top(dataset)
+        if 'picker' in stages:
+            out['picker'] = bench_picker(dataset)
+        if 'forecast' in stages:
+            out['forecast'] = bench_forecast(dataset, sample_names(dataset, fits))
+        if 'charts' in stages:
+            out['charts'] = bench_charts(dataset, sample_names(dataset, 20))
+
+    return results
+
+
+def _flatten(results, prefix=''):
+    # {'a': {'b': 1}} -> {'a.b': 1}, for comparing two runs line by line
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(before, after):
+    """Timings of two runs side by side, with how much each one changed."""
+    old = _flatten({key: before[key] for key in ['startup', 'datasets'] if key in before})
+    new = _flatten({key: after[key] for key in ['startup', 'datasets'] if key in after})
+    timings = [key for key in old if key in new and (key.endswith(('_ms', 'seconds')) or '.import_ms.' in key)]
+    return pd.DataFrame({
+        'measure': timings,
+        'before': [old[key] for key in timings],
+        'after': [new[key] for key in timings],
+        'change': [new[key] / old[key] - 1 if old[key] else np.nan for key in timings],
+    })
+
+
+if __name__ == '__main__':
+    # python benchmark.py                         -> run everything, write benchmarks/<time>_<commit>.json
+    # python benchmark.py --stages lookup top     -> only some stages
+    # python benchmark.py --compare old.json new.json -> what got faster or slower
+    parser = argparse.ArgumentParser(description="Benchmark the app's hot paths without a browser.")
+    parser.add_argument('--datasets', nargs='+', default=list(names_data.DATASETS), choices=list(names_data.DATASETS))
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--names', type=int, default=200, help='names in the lookup sample')
+    parser.add_argument('--fits', type=int, default=10, help='names in the forecast sample')
+    parser.add_argument('--output', type=Path, help='where to write the results')
+    parser.add_argument('--compare', nargs=2, type=Path, metavar=('BEFORE', 'AFTER'))
+    parser.add_argument('--load-child', nargs=2, metavar=('KEY', 'SOURCE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load_child:
+        _load_child(*args.load_child)
+    elif args.compare:
+        before, after = (json.loads(path.read_text()) for path in args.compare)
+        print(compare(before, after).to_string(index=False, float_format='%.3f'))
+    else:
+        warnings.filterwarnings('ignore', category=ConvergenceWarning)
+        results = run(args.datasets, args.stages, args.names, args.fits)
+
+        output = args.output
+        if output is None:
+            stamp = results['meta']['time'].replace(':', '').replace('-', '')[:15]
+            output = RESULTS_DIR / f"{stamp}_{results['meta']['commit'] or 'nogit'}.json"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        print(f'wrote {output}')
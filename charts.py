@@ -0,0 +1,178 @@
+# charts for the name check app, rendered once and reused
+
+import argparse
+import io
+import subprocess
+import sys
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import timing
+from forecast import ForecastCache
+
+
+# how many rendered charts we hold on to, each is a PNG of a few tens of kB
+CHART_CACHE_SIZE = 256
+
+STYLE = 'dark_background'
+
+chart_cache = ForecastCache(CHART_CACHE_SIZE)
+
+
+def series_version(name_data):
+    # changes whenever a name's rows change, so an updated name never gets an old chart
+    years = np.ascontiguousarray(name_data['Year'].to_numpy())
+    numbers = np.ascontiguousarray(name_data['Number'].to_numpy())
+    return zlib.crc32(numbers.tobytes(), zlib.crc32(years.tobytes()))
+
+
+def _render(draw):
+    # matplotlib is only imported once there's a chart to draw, a tab that never draws one never pays for it
+    from matplotlib import style
+    from matplotlib.figure import Figure
+
+    # draw on a figure that pyplot never sees, so there's nothing to close or leak
+    with style.context(STYLE):
+        fig = Figure()
+        ax = fig.subplots()
+        draw(ax)
+        ax.set_xlabel('Year')
+        ax.set_ylabel('Number')
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def _cached(key, draw):
+    png = chart_cache.get(key)
+    if png is None:
+        with timing.span('chart render', chart=key[0]):
+            png = _render(draw)
+        chart_cache.put(key, png)
+    return png
+
+
+###### server rendered ######
+
+def history_png(dataset, name, name_data):
+    def draw(ax):
+        ax.plot(name_data['Year'], name_data['Number'], color='white')
+
+    return _cached(('history', dataset, name, series_version(name_data)), draw)
+
+
+def prediction_png(dataset, name, name_data, prediction, forecast_key):
+    """The history with the forecast over it.
+
+    forecast_key says which engine and settings made the forecast, so
+    switching engine gets its own chart.
+    """
+    x_future, x_full, y_full_mean, y_full_sigma = prediction
+
+    def draw(ax):
+        ax.plot(name_data['Year'], name_data['Number'], label='Data', color='white')
+        ax.plot(x_full, y_full_mean, 'lightcoral', label='Prediction')
+        ax.legend()
+
+    return _cached(('prediction', dataset, name, forecast_key, series_version(name_data)), draw)
+
+
+def comparison_png(dataset, names, series, predictions, forecast_key):
+    # each name's history as a solid line, and its prediction dashed in the same colour
+    def draw(ax):
+        for name, name_data, (x_future, x_full, y_full_mean, y_full_sigma) in zip(names, series, predictions):
+            line, = ax.plot(name_data['Year'], name_data['Number'], label=name.capitalize())
+            ax.plot(x_future, y_full_mean[-len(x_future):], '--', color=line.get_color())
+        ax.legend()
+
+    versions = tuple(series_version(name_data) for name_data in series)
+    return _cached(('comparison', dataset, tuple(names), forecast_key, versions), draw)
+
+
+###### client side ######
+
+# the same charts as small frames indexed by year, for st.line_chart to draw in the browser
+
+def history_series(name_data):
+    # names under both genders are added up, so there's one value per year
+    return name_data.groupby('Year')['Number'].sum().rename('Number').to_frame()
+
+
+def prediction_series(name_data, prediction):
+    x_future, x_full, y_full_mean, y_full_sigma = prediction
+    fitted = pd.Series(y_full_mean, index=x_full.ravel(), name='Prediction').groupby(level=0).mean()
+    return pd.concat([history_series(name_data)['Number'].rename('Data'), fitted], axis=1)
+
+
+def comparison_series(names, series, predictions):
+    columns = {}
+    for name, name_data, (x_future, x_full, y_full_mean, y_full_sigma) in zip(names, series, predictions):
+        columns[name.capitalize()] = history_series(name_data)['Number']
+        columns[f'{name.capitalize()} (predicted)'] = pd.Series(y_full_mean[-len(x_future):], index=x_future.ravel())
+    return pd.DataFrame(columns)
+
+
+###### benchmark ######
+
+def _rss():
+    # resident memory right now, from /proc, in bytes
+    with open('/proc/self/statm') as file:
+        return int(file.read().split()[1]) * 4096
+
+
+def _old_rerun(name_data):
+    # what the app did before: pyplot figures that are never closed, rendered to PNG every time
+    import matplotlib.pyplot as plt
+    plt.style.use(STYLE)
+    plt.figure()
+    fig, ax = plt.subplots()
+    ax.plot(name_data['Year'], name_data['Number'], color='white')
+    ax.set_xlabel('Year')
+    ax.set_ylabel('Number')
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+
+def rerun_memory(mode, reruns=1000, names=20):
+    # server memory after a run of reruns cycling through a handful of names
+    import names_data
+    from name_index import lookup
+
+    dataset = names_data.load_dataset('nsw')
+    picked = [lookup(dataset, name) for name in dataset.names[:names]]
+    series = [(name, name_data) for name, name_data in zip(dataset.names, picked)]
+
+    start_rss = _rss()
+    start = time.perf_counter()
+    for i in range(reruns):
+        name, name_data = series[i % len(series)]
+        if mode == 'old':
+            _old_rerun(name_data)
+        elif mode == 'cached':
+            history_png('nsw', name, name_data)
+        else:
+            history_series(name_data)
+    elapsed = time.perf_counter() - start
+
+    print(f'{mode}: {reruns} reruns in {elapsed:.1f}s ({1000 * elapsed / reruns:.2f} ms each), '
+          f'RSS {start_rss / 1e6:.0f} -> {_rss() / 1e6:.0f} MB')
+
+
+if __name__ == '__main__':
+    # python charts.py [--reruns 1000] -> server memory and time for the old and new ways of drawing charts
+    parser = argparse.ArgumentParser(description='Measure chart rendering over many reruns.')
+    parser.add_argument('--reruns', type=int, default=1000)
+    parser.add_argument('--mode', choices=['old', 'cached', 'series'], help='run one mode in this process')
+    args = parser.parse_args()
+
+    if args.mode:
+        rerun_memory(args.mode, args.reruns)
+    else:
+        # each mode in a fresh process so they don't share memory
+        for mode in ['old', 'cached', 'series']:
+            subprocess.run([sys.executable, __file__, '--mode', mode, '--reruns', str(args.reruns)], check=True)
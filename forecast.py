@@ -0,0 +1,854 @@
+# forecasting for the name check app
+
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import names_data
+import timing
+from name_index import lookup, lookup_many
+
+
+# settings for the GP kernel, values are (initial value, bounds)
+KERNEL_CONFIG = {
+    'constant': (200, (100, 500)),
+    'length_scale': (50.0, (20, 500)),
+    'noise_level': (1, (1, 10)),
+    'n_restarts_optimizer': 10,
+}
+
+# how many forecasts we hold on to before dropping the least recently used
+CACHE_SIZE = 512
+
+# how many GP fits can run at once in the app, shared by every session
+FORECAST_WORKERS = min(4, os.cpu_count() or 1)
+
+# forecasts precomputed by precompute_forecasts.py, one row per name
+FORECAST_TABLE = Path(__file__).parent / 'data' / 'forecasts.sqlite'
+# how the arrays are stored, float32 keeps more digits than the table ever had as text
+YEARS_DTYPE = '<i2'
+VALUES_DTYPE = '<f4'
+
+# part of every row's key, bumped whenever what a row holds changes so older rows are never
+# read back. 2: the years run oldest first, version 1 rows had the history latest first
+TABLE_FORMAT = 2
+
+
+###### gaussian process ######
+
+# sklearn is the slowest thing the app imports, so it's only imported by the
+# first fit that needs it rather than when the app starts
+
+def build_kernel(y, kernel_config=KERNEL_CONFIG):
+    from sklearn.gaussian_process.kernels import RBF, ConstantKernel as C, WhiteKernel
+
+    # Define kernel parameters
+    avg = np.median(y)
+    constant, constant_bounds = kernel_config['constant']
+    length_scale, length_scale_bounds = kernel_config['length_scale']
+    noise_level, noise_level_bounds = kernel_config['noise_level']
+
+    # Define the kernel: Constant + RBF + WhiteKernel (for noise)
+    return avg + C(constant, constant_bounds) * RBF(length_scale=length_scale, length_scale_bounds=length_scale_bounds) \
+        + WhiteKernel(noise_level=noise_level, noise_level_bounds=noise_level_bounds)
+
+
+def fit_gaussian_process(name_data, kernel_config=KERNEL_CONFIG):
+    from sklearn.gaussian_process import GaussianProcessRegressor
+
+    # Extract Year and Count, the rows come in year order
+    X = name_data['Year'].values.reshape(-1, 1)
+    y = name_data['Number'].values
+
+    # Create GaussianProcessRegressor object
+    gp = GaussianProcessRegressor(kernel=build_kernel(y, kernel_config),
+                                  n_restarts_optimizer=kernel_config['n_restarts_optimizer'])
+
+    # Fit to the data
+    return gp.fit(X, y)
+
+
+def predict_gaussian_process(gp, name_data, projection_years=20):
+    X = name_data['Year'].values.reshape(-1, 1)
+
+    # Extend the Year range for projection
+    last_year = int(name_data['Year'].max())
+    x_future = np.arange(last_year + 1, last_year + projection_years + 1).reshape(-1, 1)
+    x_full = np.vstack((X, x_future))
+
+    # Make predictions for the future years
+    y_full_mean, y_full_sigma = gp.predict(x_full, return_std=True)
+
+    return x_future, x_full, y_full_mean, y_full_sigma
+
+
+def run_gaussian_process_regression(name_data, projection_years=20, kernel_config=KERNEL_CONFIG):
+    gp = fit_gaussian_process(name_data, kernel_config)
+    return predict_gaussian_process(gp, name_data, projection_years)
+
+
+###### warm starts ######
+
+# Most names end up with very similar hyperparameters, so rather than ten
+# random restarts every time the optimizer starts once from values that
+# already worked: this name's last fit if we have one, otherwise the
+# dataset's prior (the median over a sample of full fits). If that lands
+# clearly below the default kernel's starting point, we pay for the restarts.
+#
+# Where a fit starts is worked out in the process that asks for it and
+# handed to whichever process does the fitting, which hands back where the
+# fit ended up. So the last fits are remembered by the process that will ask
+# for the next ones. The prior is fitted on the pool the first time a dataset
+# is loaded without one (or up front by precompute_forecasts.py), and fits
+# asked for meanwhile do the full restarts.
+
+GP_PRIORS = Path(__file__).parent / 'data' / 'gp_priors.json'
+
+# how many names are fitted in full to build a dataset's prior
+PRIOR_SAMPLE = 15
+
+# how far (in log marginal likelihood) a warm fit may fall below the default starting point
+WARM_START_TOLERANCE = 1.0
+
+# a starting value on or next to a bound is moved this factor inside it. Most full fits
+# end on a bound, and the optimizer started right on one tends to stop there
+BOUND_MARGIN = 1.1
+
+HYPERPARAMETERS = {
+    'constant': 'k1__k2__k1__constant_value',
+    'length_scale': 'k1__k2__k2__length_scale',
+    'noise_level': 'k2__noise_level',
+}
+
+_priors = {}
+_fitting_priors = set()
+_last_fit = {}
+_warm_lock = threading.Lock()
+
+
+def learned_hyperparameters(gp):
+    params = gp.kernel_.get_params()
+    return {name: float(params[param]) for name, param in HYPERPARAMETERS.items()}
+
+
+def warm_kernel_config(hyperparameters, kernel_config=KERNEL_CONFIG):
+    # same bounds, new starting values just inside them, no restarts
+    config = dict(kernel_config, n_restarts_optimizer=0)
+    for name, value in hyperparameters.items():
+        low, high = kernel_config[name][1]
+        config[name] = (float(np.clip(value, low * BOUND_MARGIN, high / BOUND_MARGIN)), (low, high))
+    return config
+
+
+def prior_sample(dataset, sample=PRIOR_SAMPLE, seed=0):
+    # the years and numbers of a random sample of a loaded dataset's names, what its prior is fitted on
+    names = dataset.names
+    picked = np.random.default_rng(seed).choice(len(names), size=min(sample, len(names)), replace=False)
+    series = [lookup(dataset, names[i]) for i in picked]
+    return [(name_data['Year'].to_numpy(), name_data['Number'].to_numpy()) for name_data in series]
+
+
+def fit_prior(sample, kernel_config=KERNEL_CONFIG):
+    # full fits on every name in the sample, the prior is the median in log space
+    fitted = [learned_hyperparameters(fit_gaussian_process(pd.DataFrame({'Year': years, 'Number': numbers}),
+                                                           kernel_config))
+              for years, numbers in sample]
+    return {name: float(np.exp(np.median(np.log([f[name] for f in fitted])))) for name in HYPERPARAMETERS}
+
+
+def _prior_key(key, kernel_config):
+    return f'{key}/{kernel_id(kernel_config)}'
+
+
+def known_prior(key, kernel_config=KERNEL_CONFIG, path=GP_PRIORS):
+    # from memory, then from the priors file, None if it hasn't been fitted yet
+    prior_key = _prior_key(key, kernel_config)
+    with _warm_lock:
+        if prior_key in _priors:
+            return _priors[prior_key]
+
+    path = Path(path)
+    prior = (json.loads(path.read_text()) if path.exists() else {}).get(prior_key)
+    if prior is not None:
+        with _warm_lock:
+            _priors[prior_key] = prior
+    return prior
+
+
+def save_prior(key, prior, kernel_config=KERNEL_CONFIG, path=GP_PRIORS):
+    prior_key = _prior_key(key, kernel_config)
+    with _warm_lock:
+        _priors[prior_key] = prior
+
+    path = Path(path)
+    saved = json.loads(path.read_text()) if path.exists() else {}
+    saved[prior_key] = prior
+
+    # written next to the file and swapped in, so another process never reads half of it
+    with tempfile.NamedTemporaryFile('w', dir=path.parent, prefix=f'{path.name}.', delete=False) as file:
+        file.write(json.dumps(saved, indent=2))
+    os.replace(file.name, path)
+
+
+def dataset_prior(dataset, kernel_config=KERNEL_CONFIG, path=GP_PRIORS):
+    # the prior for a loaded dataset, fitted here and now if there isn't one yet
+    prior = known_prior(dataset.key, kernel_config, path)
+    if prior is None:
+        prior = fit_prior(prior_sample(dataset), kernel_config)
+        save_prior(dataset.key, prior, kernel_config, path)
+    return prior
+
+
+def request_prior(dataset, kernel_config=KERNEL_CONFIG, path=GP_PRIORS):
+    """Start fitting a loaded dataset's prior on the forecast pool, unless it has one.
+
+    Returns straight away, and a prior already being fitted isn't fitted
+    again. Until it's ready fits start from the default kernel with the
+    full set of random restarts.
+    """
+    prior_key = _prior_key(dataset.key, kernel_config)
+    with _warm_lock:
+        if prior_key in _priors or prior_key in _fitting_priors:
+            return
+        _fitting_priors.add(prior_key)
+
+    if known_prior(dataset.key, kernel_config, path) is not None:
+        with _warm_lock:
+            _fitting_priors.discard(prior_key)
+        return
+
+    fit = forecast_pool().submit(fit_prior, prior_sample(dataset), kernel_config)
+    fit.add_done_callback(lambda done: _prior_fitted(dataset.key, done, kernel_config, path))
+
+
+def _prior_fitted(key, fit, kernel_config, path):
+    try:
+        if not fit.cancelled() and fit.exception() is None:
+            save_prior(key, fit.result(), kernel_config, path)
+    finally:
+        with _warm_lock:
+            _fitting_priors.discard(_prior_key(key, kernel_config))
+
+
+def warm_start(dataset, name, gender=None, kernel_config=KERNEL_CONFIG):
+    """Where a name's next fit starts, None for the full set of random restarts.
+
+    That's its last fit if this process has seen one, otherwise the
+    dataset's prior if it has been fitted.
+    """
+    with _warm_lock:
+        start = _last_fit.get((dataset, name, gender))
+    return start if start is not None else known_prior(dataset, kernel_config)
+
+
+def remember_fit(dataset, name, gender, hyperparameters):
+    # the next fit of this name (e.g. once a new year of data lands) starts from here
+    with _warm_lock:
+        _last_fit[(dataset, name, gender)] = hyperparameters
+
+
+def warm_gaussian_process(name_data, start, kernel_config=KERNEL_CONFIG):
+    """Fit a GP with the optimizer started from hyperparameters learned on other fits.
+
+    Falls back to the full set of random restarts when the warm fit ends
+    clearly below the likelihood of the default starting point, which any
+    fit from there would at least match.
+    """
+    gp = fit_gaussian_process(name_data, warm_kernel_config(start, kernel_config))
+    default = gp.log_marginal_likelihood(build_kernel(name_data['Number'].values, kernel_config).theta)
+
+    if gp.log_marginal_likelihood_value_ < default - WARM_START_TOLERANCE:
+        return fit_gaussian_process(name_data, kernel_config)
+    return gp
+
+
+###### engines ######
+
+# every engine has the same interface: forecast() for one name, forecast_many()
+# for a list of them, both returning (x_future, x_full, y_full_mean, y_full_sigma)
+# per name, and config_key() so cached results are never mixed up between engines
+
+class GPForecaster:
+    """The original Gaussian process fit, slow but accurate.
+
+    Warm started from learned hyperparameters when it knows which dataset
+    the name comes from.
+    """
+
+    name = 'accurate'
+
+    def __init__(self, kernel_config=KERNEL_CONFIG, warm_start=True):
+        self.kernel_config = kernel_config
+        self.warm_start = warm_start
+
+    def config_key(self):
+        return (self.name, kernel_key(self.kernel_config))
+
+    def start(self, dataset, name, gender=None):
+        # where a fit of this name starts, None for the full set of random restarts
+        if self.warm_start and dataset is not None:
+            return warm_start(dataset, name, gender, self.kernel_config)
+        return None
+
+    def fit(self, name_data, projection_years=20, start=None):
+        """The forecast, and the hyperparameters the fit ended on.
+
+        Needs nothing but its arguments, so it can run in any process.
+        """
+        if start is None:
+            gp = fit_gaussian_process(name_data, self.kernel_config)
+        else:
+            gp = warm_gaussian_process(name_data, start, self.kernel_config)
+        return predict_gaussian_process(gp, name_data, projection_years), learned_hyperparameters(gp)
+
+    def forecast(self, name_data, projection_years=20, dataset=None, name=None, gender=None):
+        result, learned = self.fit(name_data, projection_years, self.start(dataset, name, gender))
+        if self.warm_start and dataset is not None:
+            remember_fit(dataset, name, gender, learned)
+        return result
+
+    def forecast_many(self, series, projection_years=20, dataset=None, names=None, gender=None):
+        names = names or [None] * len(series)
+        return [self.forecast(name_data, projection_years, dataset, name, gender)
+                for name_data, name in zip(series, names)]
+
+
+class FastForecaster:
+    """Damped log-linear trend, fitted to many names in one go.
+
+    Each name gets a weighted straight line through the log of its counts
+    over its last `window` years (recent years weigh more), and the slope is
+    damped going forward so it levels off rather than growing forever. The
+    history is smoothed with a centred rolling mean. Every step is a NumPy
+    operation over the whole names x years matrix.
+    """
+
+    name = 'fast'
+
+    def __init__(self, window=15, decay=0.85, damping=0.9, max_slope=0.3, smoothing=5):
+        self.window = window
+        self.decay = decay
+        self.damping = damping
+        self.max_slope = max_slope
+        self.smoothing = smoothing
+
+    def config_key(self):
+        return (self.name, self.window, self.decay, self.damping, self.max_slope, self.smoothing)
+
+    def forecast_matrix(self, years, counts, projection_years=20):
+        """Fit every row of a names x years count matrix, nan where a name is missing.
+
+        Returns the future means and sigmas (names x projection_years), the
+        smoothed history and its sigma (names x years), and the last year each
+        name was seen, which is where its projection starts from.
+        """
+        years = np.asarray(years)
+        observed = ~np.isnan(counts)
+        logy = np.log(np.where(observed, np.maximum(counts, 1), 1.0))
+
+        # each name's last observed year, time is measured back from there
+        last_index = counts.shape[1] - 1 - np.argmax(observed[:, ::-1], axis=1)
+        last_year = years[last_index]
+        t = (years[None, :] - last_year[:, None]).astype(float)
+
+        # weighted least squares for a line through the window, all rows at once
+        in_window = observed & (t > -self.window) & (t <= 0)
+        w = np.where(in_window, self.decay ** -t, 0.0)
+        sw, st, sy = w.sum(1), (w * t).sum(1), (w * logy).sum(1)
+        stt, sty = (w * t * t).sum(1), (w * t * logy).sum(1)
+        denom = sw * stt - st ** 2
+        slope = np.where(denom > 1e-9, (sw * sty - st * sy) / np.where(denom > 1e-9, denom, 1.0), 0.0)
+        slope = np.clip(slope, -self.max_slope, self.max_slope)
+        level = (sy - slope * st) / sw
+
+        # spread of the data around the line, in log space
+        resid = np.where(in_window, logy - (level[:, None] + slope[:, None] * t), 0.0)
+        spread = np.sqrt((w * resid ** 2).sum(1) / sw)
+
+        # damped trend: the step each year shrinks by the damping factor
+        h = np.arange(1, projection_years + 1)
+        steps = np.cumsum(self.damping ** h)
+        future_mean = np.exp(level[:, None] + slope[:, None] * steps[None, :])
+        future_sigma = future_mean * spread[:, None] * np.sqrt(1 + h[None, :] / self.window)
+
+        history_mean = _rolling_mean(counts, observed, self.smoothing)
+        history_sigma = history_mean * spread[:, None]
+
+        return future_mean, future_sigma, history_mean, history_sigma, last_year
+
+    def forecast_many(self, series, projection_years=20, dataset=None, names=None, gender=None):
+        # put every name on a shared year grid, fit them together, then split them back up
+        years = [np.asarray(name_data['Year'], dtype=int) for name_data in series]
+        first = min(y.min() for y in years)
+        grid = np.arange(first, max(y.max() for y in years) + 1)
+
+        counts = np.zeros((len(series), len(grid)))
+        seen = np.zeros((len(series), len(grid)), dtype=bool)
+        for i, (y, name_data) in enumerate(zip(years, series)):
+            # names listed under both genders are added together
+            np.add.at(counts[i], y - first, np.asarray(name_data['Number'], dtype=float))
+            seen[i, y - first] = True
+        counts[~seen] = np.nan
+
+        future_mean, future_sigma, history_mean, history_sigma, last_year = \
+            self.forecast_matrix(grid, counts, projection_years)
+
+        results = []
+        for i, y in enumerate(years):
+            # same layout as the GP: the name's own years, oldest first, then the future
+            x_hist = np.unique(y)
+            x_future = np.arange(last_year[i] + 1, last_year[i] + projection_years + 1).reshape(-1, 1)
+            x_full = np.vstack((x_hist.reshape(-1, 1), x_future))
+            y_full_mean = np.concatenate((history_mean[i, x_hist - first], future_mean[i]))
+            y_full_sigma = np.concatenate((history_sigma[i, x_hist - first], future_sigma[i]))
+            results.append((x_future, x_full, y_full_mean, y_full_sigma))
+
+        return results
+
+    def forecast(self, name_data, projection_years=20, dataset=None, name=None, gender=None):
+        return self.forecast_many([name_data], projection_years)[0]
+
+
+def _rolling_mean(values, observed, k):
+    # centred rolling mean along each row, skipping missing values
+    pad = k // 2
+    total = np.cumsum(np.pad(np.where(observed, values, 0.0), ((0, 0), (pad + 1, pad))), axis=1)
+    count = np.cumsum(np.pad(observed.astype(float), ((0, 0), (pad + 1, pad))), axis=1)
+    return (total[:, k:] - total[:, :-k]) / np.maximum(count[:, k:] - count[:, :-k], 1)
+
+
+ENGINES = {engine.name: engine for engine in [GPForecaster(), FastForecaster()]}
+
+
+###### cache ######
+
+def kernel_key(kernel_config=KERNEL_CONFIG):
+    # a hashable version of the kernel settings, so changing them never reuses old fits
+    return tuple(sorted(kernel_config.items()))
+
+
+class ForecastCache:
+    """A bounded least recently used cache of forecasts.
+
+    Shared by every session in the process, so it is guarded by a lock.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, dataset, names=None):
+        # drop a dataset's forecasts for some names, or all of them
+        with self._lock:
+            for key in [key for key in self._data if key[0] == dataset and (names is None or key[1] in names)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._data), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._data)
+
+
+forecast_cache = ForecastCache()
+
+
+def _known_forecast(forecaster, key):
+    # a forecast we already have, from the cache or for the GP the forecast table
+    result = forecast_cache.get(key)
+    if result is None and isinstance(forecaster, GPForecaster):
+        dataset, name, gender, projection_years, _ = key
+        result = precomputed_forecast(dataset, name, gender, projection_years, forecaster.kernel_config)
+        if result is not None:
+            forecast_cache.put(key, result)
+    return result
+
+
+def cached_forecast(dataset, name, name_data, gender=None, projection_years=20, engine='accurate'):
+    # only fit the first time a (dataset, name, gender, ...) forecast is asked for,
+    # and for the GP not even then if the forecast table already has it
+    forecaster = ENGINES[engine]
+    key = (dataset, name, gender, projection_years, forecaster.config_key())
+
+    result = _known_forecast(forecaster, key)
+    if result is None:
+        with timing.span('forecast fit', engine=engine, name=name):
+            result = forecaster.forecast(name_data, projection_years, dataset, name, gender)
+        forecast_cache.put(key, result)
+
+    return result
+
+
+###### background fits ######
+
+_pool = None
+_pending = {}
+_pool_lock = threading.Lock()
+
+
+def forecast_pool():
+    # started on first use; the workers are forked, a spawned worker would import
+    # __main__ again and streamlit runs the whole app script as __main__
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # imported before forking, so every worker starts with it instead of importing it again
+            import sklearn.gaussian_process  # noqa: F401
+            _pool = ProcessPoolExecutor(FORECAST_WORKERS, mp_context=multiprocessing.get_context('fork'))
+        return _pool
+
+
+def _fit_in_worker(engine, years, numbers, projection_years, start):
+    # runs in a pool process, which gets where to start from the caller and hands back where it finished
+    name_data = pd.DataFrame({'Year': years, 'Number': numbers})
+    return ENGINES[engine].fit(name_data, projection_years, start)
+
+
+def _finished_future(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _finished(key, fit, future, submitted):
+    # the worker's result goes into the cache and the warm starts before anyone waiting hears about it
+    failed = fit.cancelled() or fit.exception() is not None
+    if not failed:
+        result, learned = fit.result()
+        dataset, name, gender = key[:3]
+        if ENGINES[key[4][0]].warm_start:
+            remember_fit(dataset, name, gender, learned)
+        forecast_cache.put(key, result)
+        # from submit to done, so it includes any wait for a free worker
+        timing.record('forecast fit', time.perf_counter() - submitted, engine=key[4][0], name=name, pool=True)
+
+    with _pool_lock:
+        _pending.pop(key, None)
+    if fit.cancelled():
+        future.cancel()
+    elif failed:
+        future.set_exception(fit.exception())
+    else:
+        future.set_result(result)
+
+
+def submit_forecast(dataset, name, name_data, gender=None, projection_years=20, engine='accurate'):
+    """cached_forecast that returns a future instead of waiting for the fit.
+
+    GP fits run on the shared process pool, so forecasts for several names
+    fit at the same time while the caller gets on with drawing the page.
+    Anything already cached, and the fast engine, comes back as a finished
+    future. Asking for a forecast that is already being fitted shares that fit.
+    """
+    forecaster = ENGINES[engine]
+    key = (dataset, name, gender, projection_years, forecaster.config_key())
+
+    result = _known_forecast(forecaster, key)
+    if result is None and not isinstance(forecaster, GPForecaster):
+        result = cached_forecast(dataset, name, name_data, gender, projection_years, engine)
+
+    if result is not None:
+        return _finished_future(result)
+
+    with _pool_lock:
+        future = _pending.get(key)
+        if future is not None:
+            return future
+        future = _pending[key] = Future()
+
+    # worked out here rather than in the worker, which would have to load the prior itself
+    # and would keep the fit it learns to itself
+    try:
+        start = forecaster.start(dataset, name, gender)
+        submitted = time.perf_counter()
+        fit = forecast_pool().submit(_fit_in_worker, engine, name_data['Year'].to_numpy(),
+                                     name_data['Number'].to_numpy(), projection_years, start)
+    except Exception as error:
+        with _pool_lock:
+            _pending.pop(key, None)
+        future.set_exception(error)
+        raise
+
+    # the callback runs straight away if the fit is already done
+    fit.add_done_callback(lambda done: _finished(key, done, future, submitted))
+    return future
+
+
+def submit_forecasts(dataset, names, series, gender=None, projection_years=20, engine='accurate'):
+    """submit_forecast for several names at once, one future per name.
+
+    GP fits all go to the pool together. The fast engine fits every name
+    that isn't cached in a single forecast_many call.
+    """
+    forecaster = ENGINES[engine]
+    if isinstance(forecaster, GPForecaster):
+        return [submit_forecast(dataset, name, name_data, gender, projection_years, engine)
+                for name, name_data in zip(names, series)]
+
+    keys = [(dataset, name, gender, projection_years, forecaster.config_key()) for name in names]
+    results = [_known_forecast(forecaster, key) for key in keys]
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if missing:
+        with timing.span('forecast fit', engine=engine, names=len(missing)):
+            fitted = forecaster.forecast_many([series[i] for i in missing], projection_years, dataset,
+                                              [names[i] for i in missing])
+        for i, result in zip(missing, fitted):
+            forecast_cache.put(keys[i], result)
+            results[i] = result
+
+    return [_finished_future(result) for result in results]
+
+
+###### forecast table ######
+
+def kernel_id(kernel_config=KERNEL_CONFIG):
+    # short stable id for the kernel settings, stored in the table next to each forecast
+    return format(zlib.crc32(repr(kernel_key(kernel_config)).encode()), '08x')
+
+
+def table_key(dataset, name, gender, projection_years, kernel_config=KERNEL_CONFIG):
+    return (dataset, name, gender or '', int(projection_years), f'{kernel_id(kernel_config)}.{TABLE_FORMAT}')
+
+
+def forecast_to_row(dataset, name, gender, projection_years, kernel_config, result):
+    # flatten a forecast into a table row, the arrays are stored as their raw bytes
+    x_future, x_full, y_full_mean, y_full_sigma = result
+    return (*table_key(dataset, name, gender, projection_years, kernel_config),
+            np.asarray(x_full, dtype=YEARS_DTYPE).tobytes(), np.asarray(y_full_mean, dtype=VALUES_DTYPE).tobytes(),
+            np.asarray(y_full_sigma, dtype=VALUES_DTYPE).tobytes())
+
+
+def row_to_forecast(projection_years, years, mean, sigma):
+    x_full = np.frombuffer(years, dtype=YEARS_DTYPE).astype(int).reshape(-1, 1)
+    y_full_mean = np.frombuffer(mean, dtype=VALUES_DTYPE).astype(float)
+    y_full_sigma = np.frombuffer(sigma, dtype=VALUES_DTYPE).astype(float)
+    x_future = x_full[-projection_years:]
+    return x_future, x_full, y_full_mean, y_full_sigma
+
+
+_connections = threading.local()
+
+
+def forecast_table(path=FORECAST_TABLE):
+    """A connection to the forecast table, made once per thread.
+
+    A sqlite file with one row per forecast, so a lookup reads one row by its
+    key rather than the whole table. In WAL mode a reader never waits for
+    precompute_forecasts.py writing to it, and never sees half a write.
+    """
+    path = Path(path)
+    opened = _connections.__dict__.setdefault('opened', {})
+    if path not in opened:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS forecasts (dataset, name, gender, projection_years, kernel, '
+                           'years, mean, sigma, PRIMARY KEY (dataset, name, gender, projection_years, kernel)) '
+                           'WITHOUT ROWID')
+        opened[path] = connection
+    return opened[path]
+
+
+def table_keys(path=FORECAST_TABLE):
+    # the key of every forecast in the table
+    if not Path(path).exists():
+        return set()
+    return set(forecast_table(path).execute('SELECT dataset, name, gender, projection_years, kernel FROM forecasts'))
+
+
+def write_forecasts(rows, path=FORECAST_TABLE):
+    # rows from forecast_to_row, replacing any with the same key, all in one transaction
+    with forecast_table(path) as connection:
+        connection.executemany('INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+
+def precomputed_forecast(dataset, name, gender=None, projection_years=20, kernel_config=KERNEL_CONFIG,
+                         path=FORECAST_TABLE):
+    if not Path(path).exists():
+        return None
+    key = table_key(dataset, name, gender, projection_years, kernel_config)
+    row = forecast_table(path).execute(
+        'SELECT projection_years, years, mean, sigma FROM forecasts '
+        'WHERE dataset = ? AND name = ? AND gender = ? AND projection_years = ? AND kernel = ?', key).fetchone()
+    if row is None:
+        return None
+    return row_to_forecast(*row)
+
+
+def invalidate(dataset, names=None, path=FORECAST_TABLE):
+    """Forget the forecasts for names whose data has changed, None for the whole dataset.
+
+    They are dropped from the cache and from the forecast table, so the next
+    request fits them again and precompute_forecasts.py redoes them.
+    """
+    forecast_cache.discard(dataset, names)
+
+    if not Path(path).exists() or names is not None and not names:
+        return
+
+    with forecast_table(path) as connection:
+        if names is None:
+            connection.execute('DELETE FROM forecasts WHERE dataset = ?', (dataset,))
+        else:
+            connection.executemany('DELETE FROM forecasts WHERE dataset = ? AND name = ?',
+                                   [(dataset, name) for name in names])
+
+
+###### engine comparison ######
+
+def compare_engines(key, holdout=5, sample=100, seed=0):
+    """Hold out the last few years and see how well each engine predicts them.
+
+    Only names that are in the list for the cutoff year and most of the
+    holdout years are used, so there is something to check against.
+    """
+    dataset = names_data.load_dataset(key)
+    latest = int(dataset.frame['Year'].max())
+    cutoff = latest - holdout
+
+    train, truth, names = [], [], []
+    for name in dataset.index:
+        name_data = lookup(dataset, name)
+        years = name_data['Year'].to_numpy()
+        if cutoff in years and (years > cutoff).sum() >= holdout - 1 and (years <= cutoff).sum() >= 10:
+            names.append(name)
+            train.append(name_data[name_data['Year'] <= cutoff])
+            truth.append(name_data[name_data['Year'] > cutoff].groupby('Year')['Number'].sum())
+
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(train), size=min(sample, len(train)), replace=False)
+    train = [train[i] for i in picked]
+    truth = [truth[i] for i in picked]
+    names = [names[i] for i in picked]
+
+    # the GP with every random restart, for comparison with the warm started one
+    cold = GPForecaster(warm_start=False)
+    cold.name = 'accurate-cold'
+
+    # build the prior up front so its cost isn't counted against the first name
+    dataset_prior(dataset)
+
+    rows = []
+    for engine in [cold, *ENGINES.values()]:
+        start = time.perf_counter()
+        results = engine.forecast_many(train, holdout, key, names)
+        elapsed = time.perf_counter() - start
+
+        errors = []
+        for (x_future, _, y_full_mean, _), actual in zip(results, truth):
+            predicted = pd.Series(y_full_mean[-holdout:], index=x_future.ravel())
+            both = actual.index.intersection(predicted.index)
+            errors.append(np.abs(predicted[both] - actual[both]) / actual[both])
+
+        errors = np.concatenate(errors)
+        rows.append({'engine': engine.name, 'names': len(train), 'ms_per_name': 1000 * elapsed / len(train),
+                     'median_ape': np.median(errors), 'mean_ape': errors.mean()})
+
+    return pd.DataFrame(rows)
+
+
+###### batch latency ######
+
+def _forget_fits():
+    # so every timed run has to fit from scratch
+    forecast_cache.clear()
+    with _warm_lock:
+        _last_fit.clear()
+
+
+def batch_latency(key, sizes=(2, 3, 5, 8), engine='accurate', repeats=5, seed=0):
+    """End to end time to compare N names, one at a time against batched.
+
+    One at a time is what the app did before: a lookup and a forecast per
+    name, in turn. Batched is one lookup_many and one submit_forecasts.
+    """
+    dataset = names_data.load_dataset(key)
+    dataset_prior(dataset)
+    forecast_pool().submit(int).result()
+    rng = np.random.default_rng(seed)
+
+    rows = []
+    for n in sizes:
+        sequential, batched = [], []
+        for _ in range(repeats):
+            names = [dataset.names[i] for i in rng.choice(len(dataset.names), size=n, replace=False)]
+
+            _forget_fits()
+            start = time.perf_counter()
+            for name in names:
+                cached_forecast(key, name, lookup(dataset, name), engine=engine)
+            sequential.append(time.perf_counter() - start)
+
+            _forget_fits()
+            start = time.perf_counter()
+            found = lookup_many(dataset, names)
+            futures = submit_forecasts(key, names, [found[name] for name in names], engine=engine)
+            for future in futures:
+                future.result()
+            batched.append(time.perf_counter() - start)
+
+        rows.append({'names': n, 'sequential_ms': 1000 * np.median(sequential),
+                     'batched_ms': 1000 * np.median(batched)})
+
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    # python forecast.py compare -> accuracy and speed of each engine on held out years
+    # python forecast.py batch   -> time to compare several names, one at a time against batched
+    import warnings
+    from sklearn.exceptions import ConvergenceWarning
+
+    parser = argparse.ArgumentParser(description='Compare the forecasting engines.')
+    parser.add_argument('command', choices=['compare', 'batch'])
+    parser.add_argument('--holdout', type=int, default=5)
+    parser.add_argument('--sample', type=int, default=100)
+    parser.add_argument('--engine', default='accurate', choices=list(ENGINES))
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore', category=ConvergenceWarning)
+    for key in ['nsw', 'us']:
+        print(key)
+        if args.command == 'batch':
+            print(batch_latency(key, engine=args.engine).to_string(index=False, float_format='%.1f'))
+        else:
+            print(compare_engines(key, args.holdout, args.sample).to_string(index=False, float_format='%.3f'))
@@ -0,0 +1,161 @@
+# load test for the local query service: requests a second and latency percentiles on localhost
+
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+import numpy as np
+
+from benchmark import SEED, summarise
+from service import HOST, PORT
+
+
+SCENARIOS = ['stats', 'batch', 'top', 'forecast', 'forecast_batch', 'mixed']
+
+# names in each batch request
+BATCH_SIZE = 100
+
+
+class Connection:
+    """One HTTP/1.1 connection, reused for every request unless keep_alive is off."""
+
+    def __init__(self, host, port, keep_alive=True):
+        self.host, self.port, self.keep_alive = host, port, keep_alive
+        self.reader = self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        body = json.dumps(payload).encode() if payload is not None else b''
+        head = (f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n'
+                f"Connection: {'keep-alive' if self.keep_alive else 'close'}\r\n\r\n")
+        self.writer.write(head.encode() + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while (line := await self.reader.readline()) not in (b'\r\n', b''):
+            field, _, value = line.decode('latin-1').partition(':')
+            if field.lower() == 'content-length':
+                length = int(value)
+        body = await self.reader.readexactly(length)
+
+        if not self.keep_alive:
+            await self.close()
+        return status, body
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            await self.writer.wait_closed()
+            self.reader = self.writer = None
+
+
+def requests_for(scenario, key, names, years, rng):
+    # an endless stream of (method, path, payload) for a scenario
+    while True:
+        which = rng.choice(SCENARIOS[:-1]) if scenario == 'mixed' else scenario
+        if which == 'stats':
+            yield 'GET', '/stats?' + urlencode({'dataset': key, 'name': rng.choice(names)}), None
+        elif which == 'batch':
+            yield 'POST', '/stats', {'dataset': key, 'names': rng.choice(names, BATCH_SIZE).tolist()}
+        elif which == 'top':
+            yield 'GET', '/top?' + urlencode({'dataset': key, 'year': rng.choice(years), 'gender': rng.choice(['F', 'M'])}), None
+        elif which == 'forecast':
+            yield 'GET', '/forecast?' + urlencode({'dataset': key, 'name': rng.choice(names), 'engine': 'fast'}), None
+        else:
+            yield 'POST', '/forecast', {'dataset': key, 'names': rng.choice(names, 10).tolist(), 'engine': 'fast'}
+
+
+async def sample(host, port, key, n_years=10):
+    # names and years to ask about, taken from the service itself
+    connection = Connection(host, port)
+    _, body = await connection.request('GET', '/health')
+    dataset = json.loads(body)['datasets'][key]
+    years = np.linspace(dataset['first_year'], dataset['latest_year'], n_years).astype(int).tolist()
+
+    names = set()
+    for year in years:
+        for gender in 'FM':
+            _, body = await connection.request('GET', '/top?' + urlencode(
+                {'dataset': key, 'year': year, 'gender': gender, 'n': 200}))
+            names.update(json.loads(body)['name'])
+    await connection.close()
+    return sorted(names), years
+
+
+async def run(host, port, key, scenario, connections, requests, keep_alive=True):
+    """Send requests over a number of connections at once and time every one of them."""
+    names, years = await sample(host, port, key)
+    rng = np.random.default_rng(SEED)
+    stream = requests_for(scenario, key, names, years, rng)
+    latencies, errors = [], 0
+
+    async def client():
+        nonlocal errors
+        connection = Connection(host, port, keep_alive)
+        while len(latencies) + errors < requests:
+            method, path, payload = next(stream)
+            start = time.perf_counter()
+            status, _ = await connection.request(method, path, payload)
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+        await connection.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        'scenario': scenario,
+        'connections': connections,
+        'keep_alive': keep_alive,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'seconds': elapsed,
+        'requests_per_second': (len(latencies) + errors) / elapsed,
+        **{k: v for k, v in summarise(latencies).items() if k.endswith('_ms')},
+    }
+
+
+def spawn_service(port):
+    # a service of our own, for a test that doesn't need one already running
+    process = subprocess.Popen([sys.executable, 'service.py', '--port', str(port)], cwd=Path(__file__).parent,
+                               stdout=subprocess.PIPE, text=True)
+    process.stdout.readline()
+    return process
+
+
+if __name__ == '__main__':
+    # python load_test.py --spawn                      -> start a service and test every scenario against it
+    # python load_test.py --scenarios stats --connections 32 --no-keep-alive
+    parser = argparse.ArgumentParser(description='Load test the local query service.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--dataset', default='us')
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--connections', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--no-keep-alive', dest='keep_alive', action='store_false',
+                        help='open a new connection for every request')
+    parser.add_argument('--spawn', action='store_true', help='start a service for the test and stop it afterwards')
+    args = parser.parse_args()
+
+    process = spawn_service(args.port) if args.spawn else None
+    try:
+        for scenario in args.scenarios:
+            result = asyncio.run(run(args.host, args.port, args.dataset, scenario, args.connections,
+                                     args.requests, args.keep_alive))
+            print(f"{scenario:15} {result['requests_per_second']:9,.0f} req/s   p50 {result['p50_ms']:7.2f} ms   "
+                  f"p99 {result['p99_ms']:7.2f} ms   errors {result['errors']}")
+    finally:
+        if process is not None:
+            process.terminate()
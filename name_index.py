@@ -0,0 +1,359 @@
+# name lookups for the name check app
+
+import numpy as np
+import pandas as pd
+
+
+# a name is unisex when the less common gender has at least this share of its babies
+UNISEX_SHARE = 0.1
+
+
+def normalise_name(name):
+    # names are stored lower case without any stray spaces
+    return name.strip().lower()
+
+
+def sort_frame(df):
+    # lay the rows out by name, then gender, then year, so every name is one contiguous block
+    names = df['Name'].cat.codes.to_numpy()
+    genders = df['Gender'].cat.codes.to_numpy()
+    years = df['Year'].to_numpy()
+
+    order = np.lexsort((years, genders, names))
+    return df.take(order).reset_index(drop=True)
+
+
+def _runs(*keys):
+    # start and stop positions of each run of equal keys in sorted arrays
+    n = len(keys[0])
+    changed = np.zeros(n, dtype=bool)
+    changed[:1] = True
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+
+    starts = np.flatnonzero(changed)
+    stops = np.append(starts[1:], n)
+    return starts, stops
+
+
+class NameIndex:
+    """Where each name's rows start and stop in a frame sorted by sort_frame.
+
+    Finding a name is a dict lookup, and its rows are a slice of the frame,
+    so nothing gets copied.
+    """
+
+    def __init__(self, frame):
+        names = frame['Name'].cat.codes.to_numpy()
+        genders = frame['Gender'].cat.codes.to_numpy()
+        # plain Python strings for the keys, taking them from the Arrow backed categories one by one is slow
+        name_values = np.asarray(frame['Name'].cat.categories, dtype=object)
+        gender_values = np.asarray(frame['Gender'].cat.categories, dtype=object)
+
+        # name -> (start, stop)
+        starts, stops = _runs(names)
+        self.names = dict(zip(name_values[names[starts]], zip(starts.tolist(), stops.tolist())))
+
+        # (name, gender) -> (start, stop)
+        starts, stops = _runs(names, genders)
+        keys = zip(name_values[names[starts]], gender_values[genders[starts]])
+        self.name_genders = dict(zip(keys, zip(starts.tolist(), stops.tolist())))
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def slice(self, name, gender=None):
+        # the (start, stop) rows for a name, or None if it isn't there
+        if gender is None:
+            return self.names.get(name)
+        return self.name_genders.get((name, gender))
+
+
+class YearIndex:
+    """Every year's names for each gender, in rank order.
+
+    The rows are kept in a second, much narrower frame sorted by year,
+    gender and rank, so the top n names for a year are the first n rows of
+    that year's block, whatever n is.
+    """
+
+    def __init__(self, frame):
+        years = frame['Year'].to_numpy()
+        genders = frame['Gender'].cat.codes.to_numpy()
+        ranks = frame['Rank'].to_numpy()
+        names = frame['Name'].cat.codes.to_numpy()
+        gender_values = frame['Gender'].cat.categories
+
+        # ties in rank are broken alphabetically
+        order = np.lexsort((names, ranks, genders, years))
+        self.frame = frame[['Rank', 'Name', 'Number']].take(order).reset_index(drop=True)
+
+        # (year, gender) -> (start, stop)
+        years, genders = years[order], genders[order]
+        starts, stops = _runs(years, genders)
+        keys = zip(years[starts].tolist(), gender_values[genders[starts]])
+        self.blocks = dict(zip(keys, zip(starts.tolist(), stops.tolist())))
+
+    def top(self, year, gender, n=10):
+        # the top n names for a year as a zero-copy slice, empty if the year isn't there
+        rows = self.blocks.get((int(year), gender))
+        if rows is None:
+            return self.frame.iloc[:0]
+
+        start, stop = rows
+        return self.frame.iloc[start:min(stop, start + n)]
+
+
+class CountMatrix:
+    """Babies per year for every (name, gender), one dense matrix per gender.
+
+    counts[gender] has a row per name and a column per year, zero where the
+    name wasn't recorded. The statistics the app shows for a name are worked
+    out for every row at once when the matrix is built and kept in stats,
+    one row per (name, gender) in the frame's order, so showing a name is a
+    few array reads and asking something of every name is one reduction.
+
+    split has one row per name with how its babies divide between girls and
+    boys, and shares the share of girls in every year for the names given
+    to both, so neither needs working out when a name is looked up.
+    """
+
+    def __init__(self, frame):
+        names = frame['Name'].cat.codes.to_numpy()
+        genders = frame['Gender'].cat.codes.to_numpy()
+        years = frame['Year'].to_numpy().astype(int)
+        numbers = frame['Number'].to_numpy()
+        ranks = frame['Rank'].to_numpy()
+        name_values = frame['Name'].cat.categories
+        gender_values = frame['Gender'].cat.categories
+
+        self.years = np.arange(years.min(), years.max() + 1)
+        columns = years - self.years[0]
+
+        # one block per (name, gender), and each block's row in its gender's matrix
+        starts, stops = _runs(names, genders)
+        block = np.repeat(np.arange(len(starts)), stops - starts)
+        block_genders = genders[starts]
+        block_rows = np.zeros(len(starts), dtype=int)
+
+        self.counts = {}
+        row_totals = {}
+        totals = np.zeros(len(starts), dtype='int64')
+        peaks = np.zeros(len(starts), dtype=int)
+        latest = np.zeros(len(starts), dtype='int64')
+        for code, gender in enumerate(gender_values):
+            in_gender = block_genders == code
+            block_rows[in_gender] = np.arange(in_gender.sum())
+
+            rows = genders == code
+            counts = np.zeros((in_gender.sum(), len(self.years)), dtype='int32')
+            counts[block_rows[block[rows]], columns[rows]] = numbers[rows]
+            self.counts[gender] = counts
+
+            row_totals[gender] = totals[in_gender] = counts.sum(axis=1)
+            # the year with the most babies, ties go to the earliest
+            peaks[in_gender] = self.years[counts.argmax(axis=1)]
+            latest[in_gender] = counts[:, -1]
+
+        # the year with the best rank, ties go to the earliest
+        best_ranks = np.minimum.reduceat(ranks, starts)
+        at_best = np.flatnonzero(ranks == best_ranks[block])
+        _, first_best = np.unique(block[at_best], return_index=True)
+
+        last_years = years[stops - 1]
+        last_ranks = ranks[stops - 1]
+        in_latest = last_years == self.years[-1]
+
+        self.stats = pd.DataFrame({
+            'Name': name_values[names[starts]],
+            'Gender': gender_values[block_genders],
+            'Row': block_rows,
+            'Total': totals,
+            'FirstYear': years[starts],
+            'LastYear': last_years,
+            'LastRank': last_ranks,
+            'BestRank': best_ranks,
+            'BestYear': years[at_best[first_best]],
+            'PeakYear': peaks,
+            'LatestRank': np.where(in_latest, last_ranks, 0),
+            'LatestNumber': latest,
+        })
+
+        # the same columns as plain arrays, reading one row from these is much quicker than iloc
+        self._columns = {column: np.asarray(values, dtype=object if values.dtype == 'category' else None)
+                         for column, values in self.stats.items()}
+
+        # (name, gender) -> row of stats, keyed from plain arrays as iterating arrow backed strings is slow
+        self.rows = dict(zip(zip(self._columns['Name'], self._columns['Gender']), range(len(starts))))
+
+        # every name once, and its row in each gender's matrix, -1 if it was never given to that gender
+        name_codes = np.unique(names[starts])
+        gender_rows = {}
+        for code, gender in enumerate(gender_values):
+            in_gender = block_genders == code
+            gender_rows[gender] = np.full(len(name_codes), -1)
+            gender_rows[gender][np.searchsorted(name_codes, names[starts][in_gender])] = block_rows[in_gender]
+
+        female, male = (self._per_name(gender_rows, row_totals, gender, len(name_codes)) for gender in 'FM')
+        female_share = female / (female + male)
+        self.split = pd.DataFrame({
+            'Name': name_values[name_codes],
+            'Female': female,
+            'Male': male,
+            'FemaleShare': female_share,
+            'Unisex': np.minimum(female_share, 1 - female_share) >= UNISEX_SHARE,
+        })
+        name_keys = np.asarray(name_values, dtype=object)[name_codes]
+        self.name_rows = dict(zip(name_keys, range(len(name_codes))))
+        self._split_columns = {column: values.to_numpy() for column, values in self.split.items()}
+
+        # the share of girls in each year, for the names given to both, NaN in years neither had it
+        both = (female > 0) & (male > 0)
+        girls = self.counts['F'][gender_rows['F'][both]].astype('float32')
+        boys = self.counts['M'][gender_rows['M'][both]].astype('float32')
+        with np.errstate(invalid='ignore'):
+            self.shares = girls / (girls + boys)
+        self.share_rows = dict(zip(name_keys[both], range(both.sum())))
+
+    @staticmethod
+    def _per_name(gender_rows, row_totals, gender, n):
+        # one gender's totals lined up by name, zero for names it never had
+        rows = gender_rows.get(gender)
+        if rows is None:
+            return np.zeros(n, dtype='int64')
+        return np.where(rows >= 0, row_totals[gender][rows], 0)
+
+    def series(self, name, gender):
+        # babies per year for one (name, gender), a view of its matrix row, None if it isn't there
+        i = self.rows.get((name, gender))
+        if i is None:
+            return None
+        return self.counts[gender][self.stats['Row'].iat[i]]
+
+    def name_stats(self, name, gender=None):
+        """The statistics for a name as a dict, or None if it isn't there.
+
+        Without a gender a name given to both is described by the gender
+        more babies had, except for Total, BestRank and LatestNumber, which
+        cover both.
+        """
+        found = [self.rows.get((name, g)) for g in ([gender] if gender else self.counts)]
+        found = [i for i in found if i is not None]
+        if not found:
+            return None
+
+        totals = self._columns['Total']
+        row = max(found, key=lambda i: totals[i])
+        stats = {column: values[row].item() if isinstance(values[row], np.generic) else values[row]
+                 for column, values in self._columns.items()}
+        stats['Total'] = int(totals[found].sum())
+        stats['BestRank'] = int(self._columns['BestRank'][found].min())
+        stats['LatestNumber'] = int(self._columns['LatestNumber'][found].sum())
+        return stats
+
+    def gender_split(self, name):
+        """How a name's babies divide between girls and boys, as a dict, or None if it isn't there.
+
+        Both says it was ever given to both, Unisex that the less common
+        gender has at least UNISEX_SHARE of its babies.
+        """
+        i = self.name_rows.get(name)
+        if i is None:
+            return None
+        split = {column: values[i].item() if isinstance(values[i], np.generic) else values[i]
+                 for column, values in self._split_columns.items()}
+        split['Both'] = name in self.share_rows
+        return split
+
+    def female_share(self, name):
+        # the share of girls given the name in each year, NaN in years it wasn't recorded, None if it isn't there
+        i = self.share_rows.get(name)
+        if i is not None:
+            return self.shares[i]
+
+        split = self.gender_split(name)
+        if split is None:
+            return None
+        gender = 'F' if split['Female'] else 'M'
+        return np.where(self.series(name, gender) > 0, float(gender == 'F'), np.nan).astype('float32')
+
+
+def combine_genders(name_data):
+    """One row per year for a name given to both genders.
+
+    The babies are added up, the rank is the better of the two and the
+    gender is left empty, so a series never zig-zags between girls and boys.
+    """
+    years, position = np.unique(name_data['Year'].to_numpy(), return_inverse=True)
+    numbers = np.zeros(len(years), dtype='int64')
+    np.add.at(numbers, position, name_data['Number'].to_numpy())
+    ranks = np.full(len(years), np.iinfo('int32').max)
+    np.minimum.at(ranks, position, name_data['Rank'].to_numpy())
+
+    # each year's first row, with the totals written over it
+    _, first = np.unique(position, return_index=True)
+    combined = name_data.iloc[first].reset_index(drop=True)
+    combined['Number'] = numbers.astype(name_data['Number'].dtype)
+    combined['Rank'] = ranks.astype(name_data['Rank'].dtype)
+    combined['Gender'] = pd.Categorical([None] * len(combined), categories=name_data['Gender'].cat.categories)
+    return combined
+
+
+def lookup(dataset, name, gender=None, max_rank=None):
+    """All the rows for a name, or None if the name isn't in the dataset.
+
+    With a gender only that gender's rows are returned, as a zero-copy slice
+    in year order. Without one a name listed under both genders has them
+    added up year by year (see combine_genders), which is the only case
+    that copies. With a max_rank only the years the name ranked that high or
+    better are kept.
+    """
+    name = normalise_name(name)
+    rows = dataset.index.slice(name, gender)
+    if rows is None:
+        return None
+
+    name_data = dataset.frame.iloc[rows[0]:rows[1]]
+    if gender is None and (name, 'F') in dataset.index.name_genders and (name, 'M') in dataset.index.name_genders:
+        name_data = combine_genders(name_data)
+
+    if max_rank is not None:
+        name_data = name_data[name_data['Rank'] <= max_rank]
+        if name_data.empty:
+            return None
+
+    return name_data
+
+
+def lookup_many(dataset, names, gender=None):
+    """lookup() for several names with one gather from the frame.
+
+    Returns a dict of name -> rows, None for names that aren't in the
+    dataset. All the rows are copied out together and each name gets a
+    slice of that copy.
+    """
+    names = [normalise_name(name) for name in names]
+    spans = {name: dataset.index.slice(name, gender) for name in names}
+    found = [(name, rows) for name, rows in spans.items() if rows is not None]
+    if not found:
+        return {name: None for name in names}
+
+    positions = np.concatenate([np.arange(start, stop) for _, (start, stop) in found])
+    batch = dataset.frame.take(positions)
+
+    results = {name: None for name in names}
+    offset = 0
+    for name, (start, stop) in found:
+        name_data = batch.iloc[offset:offset + stop - start]
+        offset += stop - start
+        if gender is None and (name, 'F') in dataset.index.name_genders and (name, 'M') in dataset.index.name_genders:
+            name_data = combine_genders(name_data)
+        results[name] = name_data
+
+    return results
@@ -0,0 +1,155 @@
+# random name suggestions for the name check app
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+
+# best rank a name has ever had, (highest, lowest) rank
+RANK_BANDS = {
+    'Top 10': (1, 10),
+    'Top 100': (1, 100),
+    'Top 1000': (1, 1000),
+    'Outside the top 1000': (1001, np.iinfo('int32').max),
+}
+
+TRENDS = ['rising', 'steady', 'falling']
+
+# how many years at the end of the data the trend is measured over, compared
+# with the same number of years just before them
+TREND_YEARS = 5
+
+# how much the count has to change between the two windows to be more than steady
+TREND_THRESHOLD = 0.1
+
+
+def name_stats(dataset, trend_years=TREND_YEARS):
+    """One row per (name, gender) with the numbers the picker filters on.
+
+    Most of them come straight from the dataset's count matrix, the trend
+    is two column sums over each gender's matrix.
+    """
+    stats = dataset.matrix.stats
+    recent = np.zeros(len(stats), dtype='int64')
+    before = np.zeros(len(stats), dtype='int64')
+    for gender, counts in dataset.matrix.counts.items():
+        rows = (stats['Gender'] == gender).to_numpy()
+        recent[rows] = counts[:, -trend_years:].sum(axis=1)
+        before[rows] = counts[:, -2 * trend_years:-trend_years].sum(axis=1)
+
+    trend = np.full(len(stats), TRENDS.index('steady'))
+    trend[recent > before * (1 + TREND_THRESHOLD)] = TRENDS.index('rising')
+    trend[recent < before * (1 - TREND_THRESHOLD)] = TRENDS.index('falling')
+
+    return pd.DataFrame({
+        'Name': stats['Name'],
+        'Gender': stats['Gender'],
+        'Total': stats['Total'],
+        'BestRank': stats['BestRank'],
+        'PeakYear': stats['PeakYear'],
+        'Era': stats['PeakYear'] // 10 * 10,
+        'Recent': recent,
+        'Before': before,
+        'Trend': pd.Categorical.from_codes(trend, TRENDS),
+    })
+
+
+class AliasTable:
+    """Walker's alias method: draws from a fixed set of weights in constant time.
+
+    Every slot holds a probability and an alias. A draw picks a slot
+    uniformly and keeps it with that probability, otherwise takes its alias.
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        n = len(weights)
+        scaled = weights * n / weights.sum()
+
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        small = list(np.flatnonzero(scaled < 1))
+        large = list(np.flatnonzero(scaled >= 1))
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self, rng, size=1):
+        slots = rng.integers(len(self.prob), size=size)
+        keep = rng.random(size) < self.prob[slots]
+        return np.where(keep, slots, self.alias[slots])
+
+
+class NamePicker:
+    """Random names from a dataset, optionally weighted by popularity.
+
+    The names matching a set of filters, and the alias table for drawing
+    from them, are worked out the first time those filters are used and
+    kept, so every later draw is constant time.
+    """
+
+    def __init__(self, dataset):
+        self.stats = name_stats(dataset)
+        self._names = self.stats['Name'].to_numpy(dtype=object)
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    @property
+    def eras(self):
+        return sorted(self.stats['Era'].unique().tolist())
+
+    def _pool(self, gender, band, era, trend, weighted):
+        key = (gender, band, era, trend, weighted)
+        with self._lock:
+            if key in self._pools:
+                return self._pools[key]
+
+        stats = self.stats
+        keep = np.ones(len(stats), dtype=bool)
+        if gender is not None:
+            keep &= (stats['Gender'] == gender).to_numpy()
+        if band is not None:
+            highest, lowest = RANK_BANDS[band]
+            keep &= stats['BestRank'].between(highest, lowest).to_numpy()
+        if era is not None:
+            keep &= (stats['Era'] == era).to_numpy()
+        if trend is not None:
+            keep &= (stats['Trend'] == trend).to_numpy()
+
+        candidates = np.flatnonzero(keep)
+        weights = stats['Total'].to_numpy()[candidates] if weighted else np.ones(len(candidates))
+
+        # without a gender a name given to both has two rows, it's drawn by either
+        codes, names = pd.factorize(self._names[candidates])
+        name_weights = np.bincount(codes, weights=weights, minlength=len(names))
+        pool = (candidates, AliasTable(weights) if len(candidates) else None, np.asarray(names, dtype=object),
+                name_weights / name_weights.sum() if len(names) else name_weights)
+
+        with self._lock:
+            self._pools[key] = pool
+        return pool
+
+    def pick(self, gender=None, k=3, weighted=False, band=None, era=None, trend=None, rng=None):
+        """Up to k different names matching the filters, fewer if fewer match."""
+        rng = rng or np.random.default_rng()
+        candidates, table, names, p = self._pool(gender, band, era, trend, weighted)
+        k = min(k, len(names))
+        if k > len(names) // 2:
+            # most of the pool, drawn in one go rather than redrawing names already picked
+            return rng.choice(names, size=k, replace=False, p=p).tolist()
+
+        picked = []
+        while len(picked) < k:
+            for i in table.draw(rng, k - len(picked)):
+                name = self._names[candidates[i]]
+                if name not in picked and len(picked) < k:
+                    picked.append(name)
+        return picked
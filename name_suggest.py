@@ -0,0 +1,186 @@
+# "did you mean" suggestions for names that aren't in a dataset
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+import names_data
+from name_index import normalise_name
+
+
+# how many edits away a suggestion can be
+MAX_DISTANCE = 2
+
+# only the start of each name goes into the index, longer names are checked in full
+PREFIX_LENGTH = 7
+
+
+def edit_distance(a, b, max_distance=MAX_DISTANCE):
+    """Edits (insert, delete, substitute or swap two neighbours) to turn a into b.
+
+    Gives up as soon as the answer must be over max_distance and returns
+    max_distance + 1.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    # optimal string alignment, one row at a time
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cost = ca != cb
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], before[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        before, previous = previous, current
+
+    return min(previous[-1], max_distance + 1)
+
+
+def deletes(word, max_distance=MAX_DISTANCE):
+    # every string made by removing up to max_distance letters, the word itself included
+    found = edge = {word}
+    for _ in range(max_distance):
+        edge = {w[:i] + w[i + 1:] for w in edge for i in range(len(w))}
+        found |= edge
+    return found
+
+
+class SuggestionIndex:
+    """Close matches for a misspelt name, from a prebuilt deletion dictionary.
+
+    Every name is stored under each string you can get by deleting up to
+    max_distance letters from its first prefix_length letters. A query only
+    has to generate its own deletes and look them up, so it never scans the
+    whole vocabulary. Candidates are checked with the real edit distance and
+    ranked by distance, then by how many babies had the name.
+    """
+
+    def __init__(self, names, counts=None, max_distance=MAX_DISTANCE, prefix_length=PREFIX_LENGTH):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.words = list(names)
+        self.counts = np.zeros(len(self.words)) if counts is None else np.asarray(counts)
+
+        # delete -> ids of the names it came from
+        self.deletes = {}
+        for i, word in enumerate(self.words):
+            for key in deletes(word[:prefix_length], max_distance):
+                self.deletes.setdefault(key, []).append(i)
+
+    def __len__(self):
+        return len(self.words)
+
+    def suggest(self, name, k=5):
+        """Up to k names within max_distance edits of name, best first."""
+        name = normalise_name(name)
+        if not name:
+            return []
+
+        candidates = set()
+        for key in deletes(name[:self.prefix_length], self.max_distance):
+            candidates.update(self.deletes.get(key, ()))
+
+        scored = []
+        for i in candidates:
+            distance = edit_distance(name, self.words[i], self.max_distance)
+            if distance <= self.max_distance:
+                scored.append((distance, -self.counts[i], self.words[i]))
+
+        return [word for _, _, word in sorted(scored)[:k]]
+
+
+def build_suggestions(dataset, max_distance=MAX_DISTANCE, prefix_length=PREFIX_LENGTH):
+    """One index over the names that ever made a dataset's top list, more popular names first.
+
+    Only those are suggested, which keeps the US index to its 7k well known
+    names rather than all 100k, and small enough to build in a fraction of
+    a second.
+    """
+    frame = dataset.frame
+    codes = frame['Name'].cat.codes.to_numpy()
+    totals = np.bincount(codes, weights=frame['Number'].to_numpy(), minlength=len(frame['Name'].cat.categories))
+    names = np.asarray(frame['Name'].cat.categories, dtype=object)
+
+    present = np.zeros(len(names), dtype=bool)
+    present[codes[frame['Rank'].to_numpy() <= dataset.top_n]] = True
+    return SuggestionIndex(names[present], totals[present], max_distance, prefix_length)
+
+
+###### benchmark ######
+
+def linear_suggest(index, name, k=5):
+    # the brute force version, every name in the vocabulary gets an edit distance
+    name = normalise_name(name)
+    scored = [(edit_distance(name, word, index.max_distance), -count, word)
+              for word, count in zip(index.words, index.counts)]
+    return [word for distance, _, word in sorted(scored)[:k] if distance <= index.max_distance]
+
+
+def typo(word, rng):
+    # a random single edit, the kind of mistake people actually make
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    i = int(rng.integers(len(word)))
+    kind = rng.integers(4)
+    if kind == 0:
+        return word[:i] + word[i + 1:] or word
+    if kind == 1:
+        return word[:i] + rng.choice(list(letters)) + word[i:]
+    if kind == 2:
+        return word[:i] + rng.choice(list(letters)) + word[i + 1:]
+    if i + 1 < len(word):
+        return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word + rng.choice(list(letters))
+
+
+def benchmark(key, queries=1000, linear_queries=50, seed=0):
+    dataset = names_data.load_dataset(key)
+
+    # build time and how much memory the index holds on to
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        index = build_suggestions(dataset)
+        build_seconds = time.perf_counter() - start
+        index_bytes, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    rng = np.random.default_rng(seed)
+    picked = rng.choice(len(index), size=queries)
+    misspelt = [typo(index.words[i], rng) for i in picked]
+
+    timings, found = [], 0
+    for i, query in zip(picked, misspelt):
+        start = time.perf_counter()
+        suggestions = index.suggest(query)
+        timings.append(time.perf_counter() - start)
+        found += index.words[i] in suggestions
+
+    linear = []
+    for query in misspelt[:linear_queries]:
+        start = time.perf_counter()
+        linear_suggest(index, query)
+        linear.append(time.perf_counter() - start)
+
+    timings = 1000 * np.array(timings)
+    print(f'{key}: {len(index)} names, {len(index.deletes)} keys, built in {build_seconds:.2f}s, '
+          f'index {index_bytes / 1e6:.1f} MB')
+    print(f'  lookup median {np.median(timings):.3f} ms, p99 {np.percentile(timings, 99):.3f} ms, '
+          f'linear scan median {1000 * np.median(linear):.1f} ms, intended name found {found / queries:.1%}')
+
+
+if __name__ == '__main__':
+    # python name_suggest.py -> build time, memory and lookup latency of the suggestion index
+    parser = argparse.ArgumentParser(description='Benchmark the name suggestion index.')
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    for key in names_data.DATASETS:
+        benchmark(key, args.queries)
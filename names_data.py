@@ -0,0 +1,542 @@
+# data loading for the name check app
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+import timing
+from name_index import CountMatrix, NameIndex, YearIndex, normalise_name, sort_frame
+
+
+APP_DIR = Path(__file__).parent
+
+# NSW top 100 names, one csv covering 1952 up to the latest year,
+# refreshed each year under a new name so the newest one is used
+NSW_PATTERN = 'popular_baby_names_*.csv'
+
+# US names, one yobYYYY.txt file per year with rows of Name,Gender,Number
+US_DIR = APP_DIR / 'data' / 'names_us'
+
+# the US files list every name given to at least 5 babies, but the app's
+# "top" lists stop at this many names per gender per year
+US_TOP_N = 1000
+
+# how many rows of a US file are parsed at a time
+CHUNK_ROWS = 50_000
+
+# compact dtypes for the long format frames
+COLUMNS = ['Rank', 'Name', 'Number', 'Gender', 'Year']
+DTYPES = {'Rank': 'int32', 'Number': 'int32', 'Year': 'int16'}
+
+
+###### loaders ######
+
+def nsw_file(app_dir=APP_DIR):
+    # the latest NSW csv, the file names sort by the years they cover
+    return max(Path(app_dir).glob(NSW_PATTERN))
+
+
+def us_years(us_dir=US_DIR):
+    # every year there is a yobYYYY.txt file for
+    return sorted(int(file.stem[3:]) for file in Path(us_dir).glob('yob*.txt'))
+
+
+def load_nsw_names(file=None):
+    # read in the aus data
+    df = pd.read_csv(file or nsw_file(), dtype={'Name': 'category', 'Gender': 'category'})
+    return df[COLUMNS].astype(DTYPES)
+
+
+def rank_names(years, genders, numbers, names):
+    """Rank every row within its year and gender, in one pass over the whole table.
+
+    The most babies gets rank 1. Ties are broken alphabetically, the order
+    SSA lists them in, so every name in a year and gender gets its own rank.
+    names has to be codes into alphabetically sorted categories.
+    """
+    order = np.lexsort((names, -numbers.astype('int64'), genders, years))
+    years, genders = years[order], genders[order]
+
+    # position of the first row of each (year, gender) block, carried forward
+    position = np.arange(len(order))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (years[1:] != years[:-1]) | (genders[1:] != genders[:-1])
+    block_start = np.maximum.accumulate(np.where(first, position, 0))
+
+    ranks = np.empty(len(order), dtype='int32')
+    ranks[order] = position - block_start + 1
+    return ranks
+
+
+def load_us_names(us_dir=US_DIR, years=None, top_n=None, chunksize=CHUNK_ROWS):
+    """Stream every yobYYYY.txt file into one compact US frame.
+
+    Files are read chunksize rows at a time and each chunk is turned into
+    integer columns straight away, names becoming codes into the chunk's
+    distinct names. Those are kept as Arrow strings, a few bytes a name,
+    and merged into one vocabulary shared by every year at the end. Ranks are worked
+    out at the end by rank_names. Every row is kept unless top_n is given,
+    the top 1000 cut is applied at query time.
+    """
+    us_dir = Path(us_dir)
+    years = us_years(us_dir) if years is None else years
+
+    # each chunk's rows as codes into that chunk's own distinct names, held as Arrow strings
+    local_codes, local_names = [], []
+    genders, numbers, years_col = [], [], []
+
+    for year in years:
+        file = us_dir / f'yob{year}.txt'
+        chunks = pd.read_csv(file, header=None, names=['Name', 'Gender', 'Number'],
+                             dtype={'Name': 'str', 'Gender': object, 'Number': 'int32'}, chunksize=chunksize)
+
+        for chunk in chunks:
+            local, uniques = chunk['Name'].factorize()
+            local_codes.append(local.astype('int32'))
+            local_names.append(uniques)
+            genders.append(np.where(chunk['Gender'].to_numpy() == 'F', 0, 1).astype('int8'))
+            numbers.append(chunk['Number'].to_numpy())
+            years_col.append(np.full(len(chunk), year, dtype='int16'))
+
+    # one sorted vocabulary for every chunk's names in a single factorize, so the codes are
+    # in alphabetical order, which rank_names relies on
+    vocab, categories = pd.factorize(local_names[0].append(local_names[1:]), sort=True)
+    offsets = np.cumsum([0] + [len(names) for names in local_names])
+    del local_names
+    codes = [vocab[offset:offset + len(local)][local] for offset, local in zip(offsets, local_codes)]
+    del local_codes, vocab
+
+    # each column is joined up and its chunks dropped before the next, and the
+    # frame takes the arrays as they are rather than copying them again
+    columns = {}
+    columns['Name'] = np.concatenate(codes).astype('int32')
+    del codes
+    columns['Number'] = np.concatenate(numbers)
+    del numbers
+    columns['Gender'] = np.concatenate(genders)
+    del genders
+    columns['Year'] = np.concatenate(years_col)
+    del years_col
+
+    columns['Rank'] = rank_names(columns['Year'], columns['Gender'], columns['Number'], columns['Name'])
+    if top_n:
+        keep = columns['Rank'] <= top_n
+        columns = {column: values[keep] for column, values in columns.items()}
+
+    columns['Name'] = pd.Categorical.from_codes(columns['Name'], categories)
+    columns['Gender'] = pd.Categorical.from_codes(columns['Gender'], ['F', 'M'])
+
+    return pd.DataFrame(columns, copy=False)[COLUMNS]
+
+
+def file_order_ranks(us_dir=US_DIR, years=None):
+    # the old way of ranking, counting down each gender in file order, kept to check rank_names against
+    for year in us_years(us_dir) if years is None else years:
+        df_temp = pd.read_csv(Path(us_dir) / f'yob{year}.txt', header=None, names=['Name', 'Gender', 'Number'])
+        is_female = (df_temp['Gender'] == 'F').to_numpy()
+        df_temp['Rank'] = np.where(is_female, np.cumsum(is_female), np.cumsum(~is_female))
+        df_temp['Year'] = year
+        yield df_temp
+
+
+###### datasets ######
+
+# the two datasets the app knows about, and how many names per gender make each top list
+DATASETS = {
+    'nsw': {'label': 'NSW', 'top_n': 100},
+    'us': {'label': 'US', 'top_n': US_TOP_N},
+}
+
+GENDERS = {'male': 'M', 'female': 'F', 'm': 'M', 'f': 'F'}
+
+
+@dataclass
+class NameDataset:
+    key: str
+    frame: pd.DataFrame
+    # name -> rows in frame
+    index: NameIndex = field(repr=False)
+    # (year, gender) -> names in rank order
+    years: YearIndex = field(repr=False)
+    # babies per year for every (name, gender), and each one's statistics
+    matrix: CountMatrix = field(repr=False)
+    # names whose rows changed when this copy was brought up to date with new files,
+    # None when it was loaded whole from the source files and any of them may have
+    updated: frozenset = frozenset()
+
+    @property
+    def label(self):
+        return DATASETS[self.key]['label']
+
+    @property
+    def top_n(self):
+        return DATASETS[self.key]['top_n']
+
+    @property
+    def names(self):
+        return list(self.index)
+
+    @property
+    def first_year(self):
+        return int(self.frame['Year'].min())
+
+    @property
+    def latest_year(self):
+        return int(self.frame['Year'].max())
+
+    def __contains__(self, name):
+        return normalise_name(name) in self.index
+
+    def top(self, year, gender, n=10):
+        return self.years.top(year, gender, n)
+
+
+def _normalise_categories(values, normalise):
+    # apply normalise to the distinct values only, merging any that end up the same
+    values = values.astype('category')
+    categories = normalise(values.cat.categories.astype(str).to_series())
+    merged, inverse = np.unique(categories.to_numpy(dtype=str), return_inverse=True)
+    return pd.Categorical.from_codes(inverse[values.cat.codes.to_numpy()], merged)
+
+
+def normalise_frame(df):
+    # lower case names, single letter genders, rows laid out name by name
+    df = df.copy(deep=False)
+    df['Name'] = _normalise_categories(df['Name'], lambda names: names.str.strip().str.lower())
+    df['Gender'] = _normalise_categories(df['Gender'], lambda genders: genders.str.lower().map(GENDERS))
+    return sort_frame(df)
+
+
+def source_files(key):
+    # the files a dataset is built from
+    if key == 'nsw':
+        return [nsw_file()]
+    return [US_DIR / f'yob{year}.txt' for year in us_years()]
+
+
+def source_signature(key):
+    # changes whenever a source file is added, removed or touched
+    return tuple((file.name, file.stat().st_mtime_ns) for file in source_files(key) if file.exists())
+
+
+def concat_frames(frames):
+    # stack normalised frames, merging their categories, and lay the rows out name by name again
+    columns = {}
+    for column in COLUMNS:
+        if column in CATEGORY_COLUMNS:
+            merged = union_categoricals([frame[column].array for frame in frames], sort_categories=True)
+            columns[column] = merged.remove_unused_categories()
+        else:
+            columns[column] = np.concatenate([frame[column].to_numpy() for frame in frames])
+
+    return sort_frame(pd.DataFrame(columns, copy=False))
+
+
+def name_hashes(frame):
+    # one hash per name over all of its rows, the same whatever order the rows come in
+    names = frame['Name'].astype('category')
+    rows = pd.util.hash_pandas_object(frame[['Rank', 'Number', 'Gender', 'Year']], index=False).to_numpy()
+    codes = names.cat.codes.to_numpy()
+    totals = np.zeros(len(names.cat.categories), dtype=np.uint64)
+    np.add.at(totals, codes, rows)
+    present = np.bincount(codes, minlength=len(totals)) > 0
+    return pd.Series(totals[present], index=names.cat.categories.astype(object)[present])
+
+
+def changed_names(old, new):
+    # names whose rows differ between two versions of the same part of a dataset
+    old, new = name_hashes(old), name_hashes(new)
+    names = old.index.union(new.index)
+    i, j = old.index.get_indexer(names), new.index.get_indexer(names)
+    differ = (i < 0) | (j < 0) | (old.to_numpy()[i] != new.to_numpy()[j])
+    return frozenset(names[differ])
+
+
+def load_source_frame(key):
+    # parse the original csv / txt files, the slow path
+    loader = load_nsw_names if key == 'nsw' else load_us_names
+    return normalise_frame(loader())
+
+
+def load_dataset(key, source='auto'):
+    """Load, normalise and index one dataset.
+
+    source is 'snapshot', 'csv', or 'auto' to use the snapshot, first
+    bringing it up to date if any of its files have been added or changed
+    since it was built. updated is None on a load from the source files,
+    which can't tell what changed.
+    """
+    updated = frozenset()
+    if source == 'snapshot' or (source == 'auto' and snapshot_is_fresh(key)):
+        with timing.span('data load', dataset=key, source='snapshot'):
+            df = read_snapshot(key)
+    elif source == 'auto' and snapshot_manifest(key) is not None:
+        with timing.span('data load', dataset=key, source='update'):
+            df, updated = update_snapshot(key)
+    else:
+        with timing.span('data load', dataset=key, source='csv'):
+            df, updated = load_source_frame(key), None
+
+    with timing.span('index build', dataset=key):
+        return NameDataset(key, df, NameIndex(df), YearIndex(df), CountMatrix(df), updated)
+
+
+###### snapshots ######
+
+# prebuilt binary copies of the normalised frames, one .npy file per column
+# so they can be memory mapped straight back in
+SNAPSHOT_DIR = APP_DIR / 'data' / 'snapshot'
+
+# bumped whenever the layout changes, older snapshots are ignored until rebuilt
+SNAPSHOT_VERSION = 4
+
+NUMERIC_COLUMNS = ['Rank', 'Number', 'Year']
+CATEGORY_COLUMNS = ['Name', 'Gender']
+
+
+def write_snapshot(key, df, snapshot_dir=SNAPSHOT_DIR, sources=None):
+    """Write a snapshot, along with the signature of the files it was built from.
+
+    Each snapshot goes into a new folder of its own, and snapshot_dir/key is a
+    symlink that is then swapped over to it in one step. Another process
+    loading or writing the same snapshot at the same time sees the old one or
+    the new one, never half of one. The folder that was swapped out is only
+    removed by the write after this one, so a reader still partway through it
+    has a whole write's time to finish.
+    """
+    snapshot_dir = Path(snapshot_dir)
+    snapshot_dir.mkdir(parents=True, exist_ok=True)
+    path = snapshot_dir / key
+    tmp = Path(tempfile.mkdtemp(prefix=f'{key}.', dir=snapshot_dir))
+    # mkdtemp makes it private to this user, the app may run as another
+    tmp.chmod(0o755)
+
+    for column in NUMERIC_COLUMNS:
+        np.save(tmp / f'{column}.npy', df[column].to_numpy())
+
+    # categoricals are stored as their integer codes plus the dictionary of values
+    for column in CATEGORY_COLUMNS:
+        np.save(tmp / f'{column}_codes.npy', df[column].cat.codes.to_numpy())
+        np.save(tmp / f'{column}_categories.npy', df[column].cat.categories.to_numpy(dtype=str))
+
+    sources = source_signature(key) if sources is None else sources
+    (tmp / 'sources.json').write_text(json.dumps(dict(sources), indent=2))
+    (tmp / 'version').write_text(str(SNAPSHOT_VERSION))
+
+    previous = path.resolve() if path.is_symlink() else None
+    if path.is_dir() and not path.is_symlink():
+        # a snapshot written before they were swapped in with a symlink
+        shutil.rmtree(path)
+
+    link = snapshot_dir / f'{tmp.name}.link'
+    link.symlink_to(tmp.name)
+    os.replace(link, path)
+
+    # the snapshot just swapped out is kept for anyone still reading it, anything older goes
+    for old in snapshot_dir.glob(f'{key}.*'):
+        if old.is_dir() and not old.is_symlink() and old not in (tmp, previous):
+            shutil.rmtree(old, ignore_errors=True)
+    return path
+
+
+def read_snapshot(key, snapshot_dir=SNAPSHOT_DIR):
+    # resolved once, so every column comes from the same snapshot even if a new one is swapped in meanwhile
+    path = (Path(snapshot_dir) / key).resolve()
+
+    columns = {}
+    for column in NUMERIC_COLUMNS:
+        columns[column] = np.load(path / f'{column}.npy', mmap_mode='r')
+    for column in CATEGORY_COLUMNS:
+        codes = np.load(path / f'{column}_codes.npy', mmap_mode='r')
+        categories = np.load(path / f'{column}_categories.npy')
+        columns[column] = pd.Categorical.from_codes(codes, categories)
+
+    # copy=False so the numeric columns stay memory mapped rather than being read into memory
+    return pd.DataFrame(columns, copy=False)[COLUMNS]
+
+
+def snapshot_manifest(key, snapshot_dir=SNAPSHOT_DIR):
+    # file name -> mtime of every file the snapshot was built from, None if there's no usable snapshot
+    path = (Path(snapshot_dir) / key).resolve()
+    version = path / 'version'
+    if not version.exists() or version.read_text() != str(SNAPSHOT_VERSION):
+        return None
+    return json.loads((path / 'sources.json').read_text())
+
+
+def snapshot_is_fresh(key, snapshot_dir=SNAPSHOT_DIR):
+    # a snapshot is only used as is if it was built from exactly the files there now
+    manifest = snapshot_manifest(key, snapshot_dir)
+    return manifest is not None and manifest == dict(source_signature(key))
+
+
+def changed_sources(key, snapshot_dir=SNAPSHOT_DIR):
+    # the files added, touched or removed since the snapshot was built
+    built = snapshot_manifest(key, snapshot_dir) or {}
+    current = dict(source_signature(key))
+    return sorted(name for name in built.keys() | current.keys() if built.get(name) != current.get(name))
+
+
+def update_snapshot(key, snapshot_dir=SNAPSHOT_DIR):
+    """Bring a snapshot up to date, reading only the files that changed.
+
+    For the US every file is one year, so the rows for the changed years
+    are swapped for freshly loaded ones and everything else is taken from
+    the snapshot. NSW is a single file and is reloaded whole. Returns the
+    new frame and the names whose rows changed.
+    """
+    sources = source_signature(key)
+    changed = changed_sources(key, snapshot_dir)
+    old = read_snapshot(key, snapshot_dir)
+    if not changed:
+        return old, frozenset()
+
+    if key == 'us':
+        years = sorted(int(Path(name).stem[3:]) for name in changed)
+        present = [year for year in years if (US_DIR / f'yob{year}.txt').exists()]
+        replaced = old['Year'].isin(years).to_numpy()
+
+        old_rows = old[replaced]
+        new_rows = normalise_frame(load_us_names(years=present)) if present else old_rows.iloc[:0]
+        df = concat_frames([old[~replaced], new_rows])
+    else:
+        old_rows = old
+        df = new_rows = load_source_frame(key)
+
+    updated = changed_names(old_rows, new_rows)
+    write_snapshot(key, df, snapshot_dir, sources)
+    return read_snapshot(key, snapshot_dir), updated
+
+
+def build_snapshots(keys=DATASETS):
+    for key in keys:
+        sources = source_signature(key)
+        path = write_snapshot(key, load_source_frame(key), sources=sources)
+        print(f'{key}: wrote {path}')
+
+
+def update_snapshots(keys=DATASETS):
+    """Update every snapshot from the files that are new or changed.
+
+    Datasets without a snapshot get a full build. Returns the names updated
+    in each dataset, None where everything was rebuilt.
+    """
+    updated = {}
+    for key in keys:
+        if snapshot_manifest(key) is None:
+            build_snapshots([key])
+            updated[key] = None
+            continue
+
+        changed = changed_sources(key)
+        _, updated[key] = update_snapshot(key)
+        print(f'{key}: {len(changed)} files changed, {len(updated[key])} names updated')
+
+    return updated
+
+
+def verify_snapshots(keys=DATASETS):
+    # the csv path is kept around so the snapshot can always be checked against it
+    for key in keys:
+        pd.testing.assert_frame_equal(read_snapshot(key), load_source_frame(key), check_categorical=False)
+        print(f'{key}: snapshot matches the source files')
+
+
+def verify_ranks(us_dir=US_DIR, years=None):
+    """Check rank_names against counting down each file, for the years where that works.
+
+    Counting down only gives the right ranks when a file lists every female
+    name before the male ones, each in falling order of count.
+    """
+    new = load_us_names(us_dir, years)
+    new = new.astype({'Name': str, 'Gender': str})
+
+    checked, skipped, mismatched = [], [], []
+    for old in file_order_ranks(us_dir, years):
+        year = old['Year'].iloc[0]
+        gender_code = old['Gender'].map({'F': 0, 'M': 1}).to_numpy()
+        numbers = old['Number'].to_numpy()
+        in_order = (np.diff(gender_code) >= 0).all() and \
+            ((np.diff(numbers) <= 0) | (np.diff(gender_code) > 0)).all()
+        if not in_order:
+            skipped.append(year)
+            continue
+
+        both = old.merge(new[new['Year'] == year], on=['Year', 'Gender', 'Name'], suffixes=('_old', ''))
+        checked.append(year)
+        if len(both) != len(old) or (both['Rank_old'] != both['Rank']).any():
+            mismatched.append(year)
+
+    print(f'{len(checked)} years checked, {len(mismatched)} with different ranks {mismatched}, '
+          f'{len(skipped)} skipped as out of order {skipped}')
+    return not mismatched
+
+
+###### reporting ######
+
+def measure_load(loader, *args, **kwargs):
+    # run a loader and report how long it took and the peak python memory it used
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        df = loader(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return df, {'seconds': seconds, 'peak_bytes': peak, 'frame_bytes': int(df.memory_usage(deep=True).sum()),
+                'peak_rss_bytes': peak_rss()}
+
+
+def peak_rss():
+    # the most resident memory the process has used so far, linux reports it in kB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _print_report(label, df, stats):
+    print(f"{label}: {len(df)} rows in {stats['seconds']:.2f}s, "
+          f"peak {stats['peak_bytes'] / 1e6:.1f} MB, frame {stats['frame_bytes'] / 1e6:.1f} MB, "
+          f"process peak RSS {stats['peak_rss_bytes'] / 1e6:.0f} MB")
+
+
+if __name__ == '__main__':
+    # python names_data.py [report|build|update|verify|ranks]
+    parser = argparse.ArgumentParser(description='Load, snapshot and check the name datasets.')
+    parser.add_argument('command', nargs='?', default='report', choices=['report', 'build', 'update', 'verify', 'ranks'])
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        build_snapshots()
+
+    elif args.command == 'update':
+        # forecasts for the updated names are out of date now
+        import forecast
+        for key, names in update_snapshots().items():
+            forecast.invalidate(key, names)
+
+    elif args.command == 'verify':
+        verify_snapshots()
+
+    elif args.command == 'ranks':
+        verify_ranks()
+
+    else:
+        # report load time and memory for both datasets, from the source files and the snapshot
+        for key in DATASETS:
+            df, stats = measure_load(load_source_frame, key)
+            _print_report(f'{key} (csv)', df, stats)
+            if snapshot_is_fresh(key):
+                df, stats = measure_load(read_snapshot, key)
+                _print_report(f'{key} (snapshot)', df, stats)
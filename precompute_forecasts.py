@@ -0,0 +1,85 @@
+# precompute the GP forecast for every name so the app rarely has to fit one live,
+# and for a unisex name's girls and boys too
+#
+#   python precompute_forecasts.py [--datasets nsw us] [--workers 4] [--limit 100]
+#
+# each forecast is written to the table as soon as it finishes, so if a run
+# is interrupted just start it again and it carries on from where it stopped
+
+import argparse
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from sklearn.exceptions import ConvergenceWarning
+
+import forecast
+import names_data
+from name_index import lookup
+
+
+PROJECTION_YEARS = 20
+
+
+def fit_name(dataset, name, gender, years, numbers, start):
+    # runs in a worker process, returns the finished table row
+    warnings.filterwarnings('ignore', category=ConvergenceWarning)
+    name_data = pd.DataFrame({'Year': years, 'Number': numbers})
+    result, _ = forecast.ENGINES['accurate'].fit(name_data, PROJECTION_YEARS, start)
+    return forecast.forecast_to_row(dataset, name, gender, PROJECTION_YEARS, forecast.KERNEL_CONFIG, result)
+
+
+def pending_names(loaded, done, limit=None):
+    """Every (dataset, name, gender) that isn't in the table yet, with the data to fit it.
+
+    That is each name without a gender, which is how the app asks for most
+    of them, and a unisex name's girls and boys as well, since the app
+    starts those on one gender.
+    """
+    for key, dataset in loaded.items():
+        split = dataset.matrix.split
+        unisex = set(split.loc[split['Unisex'], 'Name'])
+        todo = [(name, gender) for name in dataset.index for gender in ([None, 'F', 'M'] if name in unisex else [None])
+                if forecast.table_key(key, name, gender, PROJECTION_YEARS) not in done]
+        for name, gender in todo[:limit]:
+            name_data = lookup(dataset, name, gender)
+            yield key, name, gender, name_data['Year'].to_numpy(), name_data['Number'].to_numpy()
+
+
+def main(datasets, workers, limit=None, path=forecast.FORECAST_TABLE):
+    done = forecast.table_keys(path)
+    loaded = {key: names_data.load_dataset(key) for key in datasets}
+    tasks = list(pending_names(loaded, done, limit))
+    print(f'{len(done)} forecasts already in {path}, {len(tasks)} to go on {workers} workers')
+
+    # fit each dataset's warm start prior once here and hand it to the workers
+    priors = {key: forecast.dataset_prior(dataset) for key, dataset in loaded.items()}
+
+    start = time.perf_counter()
+    n = 0
+
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(fit_name, *task, priors[task[0]]) for task in tasks]
+        for future in as_completed(futures):
+            forecast.write_forecasts([future.result()], path)
+
+            n += 1
+            if n % 100 == 0 or n == len(tasks):
+                elapsed = time.perf_counter() - start
+                print(f'{n}/{len(tasks)} forecasts, {n / elapsed:.1f} forecasts/s')
+
+    elapsed = time.perf_counter() - start
+    if n:
+        print(f'done: {n} forecasts in {elapsed:.1f}s, {n / elapsed:.1f} forecasts/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Precompute forecasts for every name.')
+    parser.add_argument('--datasets', nargs='+', default=list(names_data.DATASETS), choices=list(names_data.DATASETS))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--limit', type=int, default=None, help='only do this many forecasts per dataset')
+    args = parser.parse_args()
+
+    main(args.datasets, args.workers, args.limit)
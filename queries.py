@@ -0,0 +1,326 @@
+# the name check app's questions as plain functions, for the app, batch jobs and load tests
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+import forecast
+import names_data
+import trends
+from name_index import lookup, lookup_many, normalise_name
+from name_picker import NamePicker
+from name_suggest import build_suggestions
+
+
+# how often, at most, a dataset's source files are checked for changes. Checking
+# stats every file, a millisecond or so for the US data, so it isn't done per query
+RECHECK_SECONDS = 5
+
+# how far ahead the outlook looks, and how far from 1 the ratio has to be to be more than "same"
+OUTLOOK_YEARS = 10
+OUTLOOK_BAND = 0.1
+
+
+###### datasets ######
+
+# key -> (signature, when it was checked, dataset)
+_datasets = {}
+
+# (key, kind) -> (dataset, what was built from it)
+_derived = {}
+
+_lock = threading.Lock()
+
+# one lock per thing being loaded or built, so a slow build never holds up the others
+_build_locks = {}
+
+
+def _build_lock(*what):
+    with _lock:
+        return _build_locks.setdefault(what, threading.Lock())
+
+
+def dataset(key):
+    """A dataset, loaded once per process and shared by every caller.
+
+    Touching a source file loads a fresh copy the next time its files are
+    checked, and the forecasts for the names that changed are thrown away,
+    or all of the dataset's if it had to be reloaded from the source files.
+    """
+    now = time.monotonic()
+    with _lock:
+        cached = _datasets.get(key)
+    if cached is not None and now - cached[1] < RECHECK_SECONDS:
+        return cached[2]
+
+    signature = names_data.source_signature(key)
+    if cached is not None and cached[0] == signature:
+        with _lock:
+            _datasets[key] = (signature, now, cached[2])
+        return cached[2]
+
+    # one load of a dataset at a time, whoever gets here second finds it already done
+    with _build_lock(key):
+        cached = _datasets.get(key)
+        if cached is not None and cached[0] == signature:
+            return cached[2]
+
+        loaded = names_data.load_dataset(key)
+        changed = loaded.updated
+        if cached is not None and not changed:
+            # reloaded from the source files, or from a snapshot another process already brought up to date,
+            # either way the copy this process forecast from is the one to compare against
+            changed = names_data.changed_names(cached[2].frame, loaded.frame)
+        if changed:
+            forecast.invalidate(key, changed)
+        if cached is None:
+            # accurate forecasts warm start from the dataset's prior, fitted in the background if it hasn't been
+            forecast.request_prior(loaded)
+        with _lock:
+            _datasets[key] = (signature, now, loaded)
+        return loaded
+
+
+def _built(key, kind, build):
+    # something built from a dataset, kept until the dataset itself is reloaded
+    current = dataset(key)
+    with _lock:
+        cached = _derived.get((key, kind))
+    if cached is not None and cached[0] is current:
+        return cached[1]
+
+    with _build_lock(key, kind):
+        cached = _derived.get((key, kind))
+        if cached is not None and cached[0] is current:
+            return cached[1]
+        value = build(current)
+        with _lock:
+            _derived[(key, kind)] = (current, value)
+        return value
+
+
+def _year_columns(data):
+    # the year index's columns as plain arrays, slicing these is much quicker than slicing the frame
+    frame = data.years.frame
+    return data.years.blocks, {
+        'rank': frame['Rank'].to_numpy(),
+        'name': np.asarray(frame['Name'], dtype=object),
+        'number': frame['Number'].to_numpy(),
+    }
+
+
+def picker(key):
+    return _built(key, 'picker', NamePicker)
+
+
+def trend_index(key):
+    return _built(key, 'trends', trends.trend_index)
+
+
+def suggestions(key):
+    return _built(key, 'suggestions', build_suggestions)
+
+
+def warm_up(key):
+    # load a dataset and build what the queries use from it, so no query has to wait for either
+    dataset(key)
+    _built(key, 'years', _year_columns)
+    trend_index(key)
+
+
+###### queries ######
+
+def name_stats(key, name, gender=None):
+    """Everything the app says about a name as a dict, or None if it isn't in the dataset.
+
+    latest_rank is None when the name wasn't recorded in the latest year.
+    Without a gender a name given to both is described by the gender more
+    babies had, except for total, best_rank and latest_number, which cover
+    both.
+    """
+    data = dataset(key)
+    stats = data.matrix.name_stats(normalise_name(name), gender)
+    if stats is None:
+        return None
+
+    n_years = data.matrix.years[-1] - data.matrix.years[0] + 1
+    return {
+        'name': stats['Name'],
+        'gender': stats['Gender'],
+        'total': stats['Total'],
+        'n_years': int(n_years),
+        'mean_per_year': float(stats['Total'] / n_years),
+        'first_year': stats['FirstYear'],
+        'last_year': stats['LastYear'],
+        'last_rank': stats['LastRank'],
+        'best_rank': stats['BestRank'],
+        'best_year': stats['BestYear'],
+        'peak_year': stats['PeakYear'],
+        'latest_year': int(data.matrix.years[-1]),
+        'latest_rank': stats['LatestRank'] or None,
+        'latest_number': stats['LatestNumber'],
+        'in_top_n': stats['BestRank'] <= data.top_n,
+    }
+
+
+def name_stats_many(key, names, gender=None):
+    # name_stats for each name, in the same order, None for names that aren't there
+    return [name_stats(key, name, gender) for name in names]
+
+
+def gender_split(key, name):
+    """How a name's babies divide between girls and boys as a dict, or None if it isn't in the dataset.
+
+    both says it was ever given to both, unisex that the less common gender
+    has at least name_index.UNISEX_SHARE of its babies.
+    """
+    split = dataset(key).matrix.gender_split(normalise_name(name))
+    if split is None:
+        return None
+    return {
+        'name': split['Name'],
+        'female': split['Female'],
+        'male': split['Male'],
+        'female_share': split['FemaleShare'],
+        'both': split['Both'],
+        'unisex': split['Unisex'],
+    }
+
+
+def gender_share(key, name):
+    # the share of girls given a name in each year as columns, NaN in years it wasn't recorded
+    matrix = dataset(key).matrix
+    share = matrix.female_share(normalise_name(name))
+    if share is None:
+        return None
+    return {'year': matrix.years, 'female_share': share}
+
+
+def history(key, name, gender=None, max_rank=None):
+    # years and babies per year for a name, a name given to both genders has them added up unless one is asked for.
+    # With a max_rank only the years it ranked that high or better, e.g. 1000 for the SSA's published top 1000
+    name_data = lookup(dataset(key), name, gender, max_rank)
+    if name_data is None:
+        return None
+    return {'year': name_data['Year'].to_numpy(), 'number': name_data['Number'].to_numpy()}
+
+
+def top_n(key, year, gender, n=10):
+    # the top n names for a year as columns, in rank order, empty if the year isn't there
+    blocks, columns = _built(key, 'years', _year_columns)
+    start, stop = blocks.get((int(year), gender), (0, 0))
+    stop = min(stop, start + n)
+    return {column: values[start:stop] for column, values in columns.items()}
+
+
+def trending(key, gender=None, n=20, by='slope', rising=True, min_count=trends.MIN_COUNT):
+    # the n names rising (or falling) fastest as columns, see TrendIndex.top
+    rows = trend_index(key).top(gender, n, by, rising, min_count)
+    return {column.lower(): rows[column].to_numpy() for column in rows}
+
+
+def random_names(key, gender=None, k=3, weighted=False, band=None, era=None, trend=None, rng=None):
+    # up to k different names matching the filters, see NamePicker.pick
+    return picker(key).pick(gender, k, weighted, band, era, trend, rng)
+
+
+def suggest(key, name):
+    # the closest names in the dataset to one that isn't there
+    return suggestions(key).suggest(normalise_name(name))
+
+
+def outlook(prediction, latest_number, years=OUTLOOK_YEARS):
+    """Whether a forecast says a name is going up, down or staying about the same.
+
+    Returns (ratio, 'increase' | 'decrease' | 'same'), the ratio being the
+    forecast number of babies that many years on over the latest number.
+    """
+    _, _, mean, _ = prediction
+    ratio = float(mean[-years] / latest_number)
+    if ratio < 1 - OUTLOOK_BAND:
+        return ratio, 'decrease'
+    if ratio > 1 + OUTLOOK_BAND:
+        return ratio, 'increase'
+    return ratio, 'same'
+
+
+def submit_forecasts(key, names, gender=None, engine='accurate', projection_years=20):
+    """Start the forecasts for several names without waiting for them.
+
+    Returns name -> future, None for names that aren't in the dataset. The
+    fits share the app's cache and process pool, see forecast.submit_forecasts.
+    """
+    names = list(dict.fromkeys(normalise_name(name) for name in names))
+    found = lookup_many(dataset(key), names, gender)
+    present = [name for name in names if found[name] is not None]
+    futures = forecast.submit_forecasts(key, present, [found[name] for name in present], gender,
+                                        projection_years, engine) if present else []
+    return {name: None for name in names} | dict(zip(present, futures))
+
+
+def forecast_record(key, name, prediction, gender=None, engine='accurate'):
+    # a finished forecast as plain arrays, with the outlook for names recorded in the latest year
+    x_future, x_full, mean, sigma = prediction
+    latest = name_stats(key, name, gender)['latest_number']
+    ratio, direction = outlook(prediction, latest) if latest else (None, None)
+    return {
+        'name': name,
+        'engine': engine,
+        'year': x_full.ravel(),
+        'mean': np.asarray(mean),
+        'sigma': np.asarray(sigma),
+        'future_years': x_future.ravel(),
+        'ratio': ratio,
+        'outlook': direction,
+    }
+
+
+def forecast_name(key, name, gender=None, engine='accurate', projection_years=20):
+    """A name's forecast as plain arrays, or None if it isn't in the dataset.
+
+    With a gender only that gender's babies are fitted, without one a name
+    given to both is fitted on the two added up. Waits for the fit, which is
+    cached like the app's. ratio and outlook are None for names that weren't
+    recorded in the latest year.
+    """
+    name = normalise_name(name)
+    name_data = lookup(dataset(key), name, gender)
+    if name_data is None:
+        return None
+
+    prediction = forecast.cached_forecast(key, name, name_data, gender, projection_years, engine)
+    return forecast_record(key, name, prediction, gender, engine)
+
+
+if __name__ == '__main__':
+    # python queries.py -> how many of each query one process answers a second
+    parser = argparse.ArgumentParser(description='Measure query throughput without a browser.')
+    parser.add_argument('--datasets', nargs='+', default=list(names_data.DATASETS), choices=list(names_data.DATASETS))
+    parser.add_argument('--queries', type=int, default=10_000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for key in args.datasets:
+        start = time.perf_counter()
+        data = dataset(key)
+        picker(key), trend_index(key)
+        print(f'{key}: ready in {time.perf_counter() - start:.2f}s')
+
+        names = sorted(data.names)
+        sample = [names[i] for i in rng.integers(len(names), size=args.queries)]
+        years = rng.integers(data.first_year, data.latest_year + 1, size=args.queries).tolist()
+        calls = {
+            'name_stats': lambda i: name_stats(key, sample[i]),
+            'top_n': lambda i: top_n(key, years[i], 'FM'[i % 2], 10),
+            'trending': lambda i: trending(key, 'FM'[i % 2]),
+            'random_names': lambda i: random_names(key, 'FM'[i % 2], rng=rng),
+            'forecast (fast)': lambda i: forecast_name(key, sample[i], engine='fast'),
+        }
+        for label, call in calls.items():
+            start = time.perf_counter()
+            for i in range(args.queries):
+                call(i)
+            elapsed = time.perf_counter() - start
+            print(f'  {label:16} {args.queries / elapsed:10,.0f} a second')
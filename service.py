@@ -0,0 +1,372 @@
+# a local HTTP/JSON service over the query module, so other tools can ask about names without a browser
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy as np
+
+import forecast
+import names_data
+import queries
+import timing
+import trends
+
+
+HOST = '127.0.0.1'
+PORT = int(os.environ.get('NAMECHECK_SERVICE_PORT') or 8765)
+
+# an idle keep-alive connection is closed after this long
+KEEPALIVE_SECONDS = 15
+
+# the biggest request body and the most names one batch request can ask about
+MAX_BODY = 1 << 20
+MAX_BATCH = 1000
+
+# accurate forecasts fitting at once across every request, the rest wait their turn. A GP fit
+# is a whole CPU for up to seconds, so there is no point starting more than there are workers
+FORECAST_SLOTS = forecast.FORECAST_WORKERS
+
+# the most names one request can ask for accurate forecasts of, so one request can't
+# queue up enough fits to keep everyone else waiting for minutes
+MAX_ACCURATE_BATCH = 20
+
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+          413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _jsonable(value):
+    # numpy results as plain JSON, NaN as null
+    if isinstance(value, np.ndarray):
+        if value.dtype.kind == 'f':
+            return np.where(np.isnan(value), None, value.astype(object)).tolist()
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f'{type(value).__name__} is not JSON serialisable')
+
+
+###### parameters ######
+
+def _dataset(params):
+    key = params.get('dataset', 'nsw')
+    if key not in names_data.DATASETS:
+        raise HTTPError(400, f"unknown dataset {key!r}, expected one of {', '.join(names_data.DATASETS)}")
+    return key
+
+
+def _gender(params, required=False):
+    gender = params.get('gender')
+    if gender is None and not required:
+        return None
+    gender = names_data.GENDERS.get(str(gender).lower(), str(gender).upper())
+    if gender not in ('F', 'M'):
+        raise HTTPError(400, 'gender must be F or M')
+    return gender
+
+
+def _int(params, name, default=None):
+    value = params.get(name, default)
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f'{name} must be a whole number') from None
+
+
+def _name(params):
+    name = params.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise HTTPError(400, 'name is required')
+    return name
+
+
+def _names(params):
+    names = params.get('names')
+    if isinstance(names, str):
+        names = names.split(',')
+    if not isinstance(names, list) or not names or not all(isinstance(name, str) for name in names):
+        raise HTTPError(400, 'names must be a list of names')
+    if len(names) > MAX_BATCH:
+        raise HTTPError(400, f'at most {MAX_BATCH} names per request')
+    return names
+
+
+def _engine(params, n_names=1):
+    engine = params.get('engine', 'fast')
+    if engine not in forecast.ENGINES:
+        raise HTTPError(400, f"engine must be one of {', '.join(forecast.ENGINES)}")
+    if engine == 'accurate' and n_names > MAX_ACCURATE_BATCH:
+        raise HTTPError(400, f'at most {MAX_ACCURATE_BATCH} names per request with the accurate engine')
+    return engine
+
+
+###### endpoints ######
+
+# the queries are plain functions that can take a while the first time (a dataset load, an
+# index build) or when a data file changes, so they run on a worker thread and the event
+# loop carries on answering everyone else
+
+async def health(params):
+    datasets = {key: await asyncio.to_thread(queries.dataset, key) for key in names_data.DATASETS}
+    return {
+        'status': 'ok',
+        'datasets': {key: {'names': len(data.index), 'first_year': data.first_year, 'latest_year': data.latest_year}
+                     for key, data in datasets.items()},
+        'forecast_slots': FORECAST_SLOTS,
+    }
+
+
+async def stats(params):
+    record = await asyncio.to_thread(queries.name_stats, _dataset(params), _name(params), _gender(params))
+    if record is None:
+        raise HTTPError(404, 'name not found')
+    return record
+
+
+async def stats_batch(params):
+    key, names, gender = _dataset(params), _names(params), _gender(params)
+    return {'results': dict(zip(names, await asyncio.to_thread(queries.name_stats_many, key, names, gender)))}
+
+
+async def gender(params):
+    key, name = _dataset(params), _name(params)
+    split = await asyncio.to_thread(queries.gender_split, key, name)
+    if split is None:
+        raise HTTPError(404, 'name not found')
+    return {**split, 'by_year': await asyncio.to_thread(queries.gender_share, key, name)}
+
+
+async def history(params):
+    max_rank = _int(params, 'max_rank') if 'max_rank' in params else None
+    record = await asyncio.to_thread(queries.history, _dataset(params), _name(params), _gender(params), max_rank)
+    if record is None:
+        raise HTTPError(404, 'name not found')
+    return record
+
+
+async def top(params):
+    key = _dataset(params)
+    latest = (await asyncio.to_thread(queries.dataset, key)).latest_year
+    return await asyncio.to_thread(queries.top_n, key, _int(params, 'year', latest),
+                                   _gender(params, required=True), _int(params, 'n', 10))
+
+
+async def trending(params):
+    by = params.get('by', 'slope')
+    if by not in trends.METRICS:
+        raise HTTPError(400, f"by must be one of {', '.join(trends.METRICS)}")
+    rising = str(params.get('rising', 'true')).lower() not in ('false', '0', 'no')
+    return await asyncio.to_thread(queries.trending, _dataset(params), _gender(params), _int(params, 'n', 20),
+                                   by, rising)
+
+
+def _fast_forecasts(key, names, gender, engine, projection_years):
+    # every name fitted in one go, run on a thread
+    futures = queries.submit_forecasts(key, names, gender, engine, projection_years)
+    return {name: queries.forecast_record(key, name, future.result(), gender, engine) if future is not None else None
+            for name, future in futures.items()}
+
+
+async def _forecast(key, name, gender, engine, projection_years):
+    # one name's forecast record, or None if it isn't in the dataset. The fit runs on the
+    # forecast pool and the event loop only waits for it
+    future = (await asyncio.to_thread(queries.submit_forecasts, key, [name], gender, engine, projection_years))[name]
+    if future is None:
+        return None
+    prediction = await asyncio.wrap_future(future)
+    return await asyncio.to_thread(queries.forecast_record, key, name, prediction, gender, engine)
+
+
+async def _forecasts(key, names, gender, engine, projection_years):
+    """name -> forecast record, None for names that aren't in the dataset.
+
+    The fast engine fits every name in one go on a thread. Accurate fits
+    each take a slot, so however the requests split them up no more than
+    FORECAST_SLOTS are fitting or queued on the pool at once. Names already
+    cached or in the forecast table give their slot straight back.
+    """
+    names = list(dict.fromkeys(names_data.normalise_name(name) for name in names))
+    if engine != 'accurate':
+        return await asyncio.to_thread(_fast_forecasts, key, names, gender, engine, projection_years)
+
+    async def one(name):
+        async with _forecast_slots:
+            return await _forecast(key, name, gender, engine, projection_years)
+
+    return dict(zip(names, await asyncio.gather(*(one(name) for name in names))))
+
+
+async def forecast_one(params):
+    key, name = _dataset(params), _name(params)
+    results = await _forecasts(key, [name], _gender(params), _engine(params), _int(params, 'projection_years', 20))
+    record = next(iter(results.values()))
+    if record is None:
+        raise HTTPError(404, 'name not found')
+    return record
+
+
+async def forecast_batch(params):
+    key, names = _dataset(params), _names(params)
+    results = await _forecasts(key, names, _gender(params), _engine(params, len(names)),
+                               _int(params, 'projection_years', 20))
+    # keyed by the names as they were asked for
+    return {'results': {name: results[names_data.normalise_name(name)] for name in names}}
+
+
+# (method, path) -> endpoint, GET takes its parameters from the query string, POST from a JSON body
+ROUTES = {
+    ('GET', '/health'): health,
+    ('GET', '/stats'): stats,
+    ('POST', '/stats'): stats_batch,
+    ('GET', '/gender'): gender,
+    ('GET', '/history'): history,
+    ('GET', '/top'): top,
+    ('GET', '/trending'): trending,
+    ('GET', '/forecast'): forecast_one,
+    ('POST', '/forecast'): forecast_batch,
+}
+
+_forecast_slots = None
+
+
+###### http ######
+
+async def read_request(reader):
+    """One request off a connection: (method, target, headers, body), or None once the client has gone."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400, 'malformed request line') from None
+
+    # ':version' can't clash with a real header, those never contain a colon
+    headers = {':version': version}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        field, _, value = line.decode('latin-1').partition(':')
+        headers[field.strip().lower()] = value.strip()
+
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise HTTPError(400, 'malformed Content-Length') from None
+    if length > MAX_BODY:
+        raise HTTPError(413, f'request bodies are limited to {MAX_BODY} bytes')
+    body = await reader.readexactly(length) if length else b''
+    return method, target, headers, body
+
+
+def keep_alive(headers):
+    # HTTP/1.1 connections stay open unless the client says otherwise, HTTP/1.0 ones only if it asks
+    connection = headers.get('connection', '').lower()
+    if headers[':version'] == 'HTTP/1.0':
+        return connection == 'keep-alive'
+    return connection != 'close'
+
+
+def response(status, payload, keep_open, content_type='application/json'):
+    body = payload if isinstance(payload, bytes) else json.dumps(payload, default=_jsonable).encode()
+    head = (f'HTTP/1.1 {status} {STATUS[status]}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f"Connection: {'keep-alive' if keep_open else 'close'}\r\n\r\n")
+    return head.encode() + body
+
+
+async def dispatch(method, target, body):
+    url = urlsplit(target)
+    if url.path == '/metrics' and method == 'GET':
+        return 200, timing.metrics_text().encode(), 'text/plain; version=0.0.4'
+
+    endpoint = ROUTES.get((method, url.path))
+    if endpoint is None:
+        known = any(path == url.path for _, path in ROUTES)
+        raise HTTPError(405 if known else 404, f'no {method} {url.path}')
+
+    params = dict(parse_qsl(url.query))
+    if body:
+        try:
+            params.update(json.loads(body))
+        except (ValueError, TypeError):
+            raise HTTPError(400, 'the body must be a JSON object') from None
+    return 200, await endpoint(params), 'application/json'
+
+
+async def handle_connection(reader, writer):
+    # requests are answered in order, one at a time, until the client closes or goes quiet
+    try:
+        while True:
+            try:
+                request = await asyncio.wait_for(read_request(reader), KEEPALIVE_SECONDS)
+            except HTTPError as error:
+                writer.write(response(error.status, {'error': error.message}, False))
+                break
+            if request is None:
+                break
+
+            method, target, headers, body = request
+            keep_open = keep_alive(headers)
+            start = time.perf_counter()
+            try:
+                status, payload, content_type = await dispatch(method, target, body)
+            except HTTPError as error:
+                status, payload, content_type = error.status, {'error': error.message}, 'application/json'
+            except Exception as error:
+                status, payload, content_type = 500, {'error': f'{type(error).__name__}: {error}'}, 'application/json'
+            timing.record('request', time.perf_counter() - start, path=urlsplit(target).path, status=status)
+
+            writer.write(response(status, payload, keep_open, content_type))
+            await writer.drain()
+            if not keep_open:
+                break
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host=HOST, port=PORT, preload=tuple(names_data.DATASETS)):
+    """Run the service until it's stopped.
+
+    The datasets are loaded, and what the queries build from them is built,
+    before the port opens, so no request waits on either.
+    """
+    global _forecast_slots
+    _forecast_slots = asyncio.Semaphore(FORECAST_SLOTS)
+    for key in preload:
+        await asyncio.to_thread(queries.warm_up, key)
+
+    server = await asyncio.start_server(handle_connection, host, port)
+    print(f'serving on http://{host}:{port}', flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    # python service.py                      -> serve on 127.0.0.1:8765
+    # curl 'localhost:8765/stats?dataset=us&name=harvey'
+    # curl -d '{"dataset": "us", "names": ["olivia", "emma"]}' localhost:8765/forecast
+    parser = argparse.ArgumentParser(description='Serve name statistics and forecasts as JSON on localhost.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--preload', nargs='*', default=list(names_data.DATASETS), choices=list(names_data.DATASETS))
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.preload))
+    except KeyboardInterrupt:
+        pass
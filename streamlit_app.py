@@ -1,567 +1,399 @@
 # app to analyse the top 100 baby names over time in NSW
 
-import numpy as np
-import pandas as pd
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF, ConstantKernel as C, ExpSineSquared, WhiteKernel, Matern
+from functools import partial
+
 import streamlit as st
-import matplotlib.pyplot as plt
+
+import charts
+import forecast
+import names_data
+import queries
+import timing
+from name_index import lookup, lookup_many
+from name_picker import RANK_BANDS, TRENDS
 
  
 # TO DO:
-# - implement a gender checker of some kind to catch names that appear in both gender lists 
 # - add page for top 10 by year 
-# - account for trailing spaces 
-# - if name isnt found ask whether they mean a similar name
 # - GP kernel sufficient?
 # - check what the average is doing - over all years or the ones it is in the dataset for?
 
 
 ###### functions #######
 
-def run_gaussian_process_regression(name_data, projection_years=20):
-    # Extract Year and Count
-    X = name_data['Year'].values[::-1].reshape(-1, 1)
-    y = name_data['Number'].values[::-1]
+@st.cache_resource
+def metrics_server(port):
+    # one /metrics endpoint per process, however many sessions there are
+    return timing.serve_metrics(port)
 
-    
 
-    # Define kernel parameters
-    length_scale = 10.0
-    variance = y.std()
-    avg = np.median(y)
+def did_you_mean(key, name):
+    # offer the closest names in the dataset, if there are any
+    suggestions = queries.suggest(key, name)
+    if suggestions:
+        st.write("Did you mean " + ", ".join(f":red[{s.capitalize()}]" for s in suggestions) + "?")
 
-    # Define the kernel: Constant + RBF + Periodic + WhiteKernel (for noise)
-    kernel = avg + C(200, (100, 500)) * RBF(length_scale=50.0, length_scale_bounds=(20, 500))  + WhiteKernel(noise_level=1, noise_level_bounds=(1, 10))
 
+def table(columns):
+    # query results as a table, with headings for people rather than code
+    return {column.replace('_', ' ').capitalize(): values for column, values in columns.items()}
 
-    # Create GaussianProcessRegressor object
-    gp = GaussianProcessRegressor(kernel=kernel, n_restarts_optimizer=10)
 
-    # Fit to the data
-    gp.fit(X, y)
+# how the Check a name tabs talk about each dataset
+DATASET_TEXT = {
+    'nsw': {'place': 'NSW', 'records': 'the top 100'},
+    'us': {'place': 'the US', 'records': 'the US records'},
+}
 
-    # Make predictions
-    y_pred, sigma = gp.predict(X, return_std=True)
 
-    # Extend the Year range for projection
-    last_year = name_data['Year'].max()
-    x_future = np.arange(last_year + 1, last_year + projection_years + 1).reshape(-1, 1)
-    x_full = np.vstack((X, x_future))
+def check_name(key, default, engine):
+    """The Check a name tab: a name's statistics, its history and its forecast.
 
-    # Make predictions for the future years
-    y_full_mean, y_full_sigma = gp.predict(x_full, return_std=True)
+    The forecast is started straight away and filled in at the end of the
+    page, once everything else is showing.
+    """
+    dataset = queries.dataset(key)
+    text = DATASET_TEXT[key]
 
-    return x_future, x_full, y_full_mean, y_full_sigma
+    # what name do you want to check? 
+    # ask the user to input a name
+    name = st.text_input("What name do you want to check?", default, key=f'name_{key}')
+    st.write(f"Currently checking :red[{name}]")
 
+    # make the name lower case, without any trailing spaces
+    name = names_data.normalise_name(name)
 
+    # how the name divides between girls and boys, None if it isn't in the list
+    split = queries.gender_split(key, name)
+    if split is None:
+        st.write(f"That name has never been in {text['records']}, it must be unique 😲")
+        did_you_mean(key, name)
+        return
 
-###### end functions ####### 
+    # a unisex name can be looked at for girls, boys, or both added together, starting
+    # with whichever had more babies. Any other name is its babies added up, which for
+    # a name only now and then given to the other gender is as good as the main one
+    gender = None
+    if split['unisex']:
+        choices = {'F': "Girls", 'M': "Boys", None: "Both added together"}
+        gender = st.radio("Which babies?", list(choices), index=0 if split['female_share'] >= 0.5 else 1,
+                          format_func=choices.get, horizontal=True, key=f'gender_{key}_{name}')
 
-###### app text ######
+    # get the stats and the rows for the name
+    with timing.span('lookup', dataset=key):
+        stats = queries.name_stats(key, name, gender)
+        name_data = lookup(dataset, name, gender)
 
-st.set_page_config(page_title="Name Check 📈")
-st.title("Name Check 📈")
-st.header(":red[Welcome to the Name Check App!]")
-st.subheader("Need to name a child? Want to know more about your name? You're in the right place!")
-#st.markdown("As a Rebecca born in the 90s I am acutely aware of *how annoying* it can be to have an extremely common name. With this app you can check how **common prospective names are at the moment**, how common they were in the **past**, and whether they are about to be **trending**.")
+    if stats['in_top_n']:
+        st.write(f'That name is in the top {dataset.top_n}. Scroll down for statistics, graphs, and predictions...')
+    else:
+        st.write(f'That name has never been in the top {dataset.top_n}, but it is in the records. Scroll down for statistics, graphs, and predictions...')
 
-st.text("This app is maintained by R. McElroy and uses census data from the NSW & US Government.")
-st.page_link("https://rebeccamcelroy.github.io/", label="Rebecca's Homepage", icon="🏠")
+    # start the forecast, reusing an earlier fit if there is one,
+    # it runs in the background while the rest of the page is drawn
+    prediction = forecast.submit_forecast(key, name, name_data, gender, engine=engine)
 
-# read in the aus data
-file = 'popular_baby_names_1952_to_2023.csv'
-df = pd.read_csv(file)
-
-# read in the us data
-
-# loop over all the files in directory names_us
-n = 0
-for i in range(1880, 2024):
-    file = f'./data/names_us/yob{i}.txt'
-    df_temp = pd.read_csv(file, header=None)
-
-    # add the year to the dataframe
-    df_temp['Year'] = i
-
-    # keep only the top 1000 female names
-    df_female = df_temp.head(1000)
-    # how many elements are there in the dataframe
-    n_elements = len(df_female)
-    # add a column for rank
-    df_female['Rank'] = np.arange(1, n_elements+1)
-
-    # select out the male names
-    df_male = df_temp[df_temp[1] == 'M']
-    # keep only the top 1000 male names
-    df_male = df_male.head(1000)
-    # how many elements are there in the dataframe
-    n_elements = len(df_male)
-    # add a column for rank
-    df_male['Rank'] = np.arange(1, n_elements+1)
-
-    # combine the two dataframes
-    df_temp = pd.concat([df_female, df_male])
-    
-    # add the data to the main dataframe
-    if n == 0:
-        df_us = df_temp
+    # recapitalise the name for output 
+    display_name = name.capitalize()
 
-    else:
-        df_us = pd.concat([df_us, df_temp])
+    tab_stats, tab_graph, tab_predictions = st.tabs(["Statistics", "Graph", "Predictions"])
+    with tab_stats:
+        st.header("Statistics")
 
-    n += 1
+        # check whether the name made the list in the latest year
+        if stats['latest_rank']:
+            st.write(f":red[{display_name}] was ranked :red[{stats['latest_rank']}] in {stats['latest_year']}, "
+                     f":red[{stats['latest_number']}] babies were called this.")
+        else:
+            st.write(f":red[{display_name}] was last in {text['records']} in {stats['last_year']} "
+                     f"when it was ranked {stats['last_rank']}.")
+
+        st.write(f"On average :red[{int(stats['mean_per_year'])}] babies were named :red[{display_name}] "
+                 f"in {text['place']} each year over the past {stats['n_years']} years.")
+
+        # its best rank, and the first year it had it
+        st.write(f":red[{display_name}] was most popular in {stats['best_year']}, when it was ranked {stats['best_rank']}.")
+
+        if split['unisex']:
+            st.write(f":red[{display_name}] is given to girls and boys, {split['female_share']:.1%} of the babies "
+                     f"named it were girls.")
+
+        # future stats
+        # what does the model think 
+        if stats['latest_rank']:
+            st.write(f"⚠️ :red[Warning, prediction optimizer in flux:]")
+            # filled in with the forecast at the end of the page
+            outlook = st.empty()
+            outlook.write("Working out the prediction...")
+            number_latest = stats['latest_number']
+        else:
+            outlook = number_latest = None
+            st.write(f":red[{display_name}] wasn't in {text['records']} last year, should be safe to use. ")
+
+    with tab_graph:
+        st.header(display_name+" over time")
+        # plot the name prevalence over time 
+        if interactive:
+            st.line_chart(charts.history_series(name_data))
+        else:
+            st.image(charts.history_png(key, name, name_data))
 
+        if split['both']:
+            st.subheader("Share of girls each year")
+            st.line_chart(table(queries.gender_share(key, name)), x='Year', y='Female share')
 
-# change the names of the columns
-# Name, Gender, Number, Year
-df_us.rename(columns = {df_us.columns[0]: 'Name'}, inplace=True)
-df_us.rename(columns = {df_us.columns[1]: 'Gender'}, inplace=True)
-df_us.rename(columns = {df_us.columns[2]: 'Number'}, inplace=True)
+    with tab_predictions:
+        st.header("Predictions for "+display_name)
+        # filled in with the forecast at the end of the page
+        chart = st.empty()
+        chart.write("Working out the prediction...")
 
+    pending.append(partial(show_forecast, key, name, prediction, outlook, chart, name_data, display_name, number_latest))
 
 
-tab_aus, tab_us = st.tabs(["Australia - NSW", "USA"])
+# the choices for how many names the "Check a year" tabs show
+TOP_N_CHOICES = [10, 100, 1000]
 
-with tab_aus:
 
-    tab_check, tab_history = st.tabs(["Check a name", "Check a year"])
-
-    with tab_check:
-
-        # make all the names lower case
-        df['Name'] = df['Name'].str.lower()
-
-        # group the data
-        grouped = df.groupby('Name')
-
-        # what name do you want to check? 
-        # ask the user to input a name
-        name = st.text_input("What name do you want to check?", "James")
-        st.write(f"Currently checking :red[{name}]")
-
-        #gender = st.text_input("What gender statistics do you want to see?", "Male")
-        #st.write("The current gender is", gender)
-
-        # make the name lower case
-        name = name.lower()
-
-        # check if the name is in the list
-        if name in grouped.groups:
-            st.write('That name is in the top 100. Scroll down for statistics, graphs, and predictions...')
-
-            # get the data for the name
-            name_data = grouped.get_group(name)
-
-            # Alternatively, if you need to filter by both name and gender:
-            #name_data = grouped[(grouped['Name'] == name) & (grouped['Gender'] == gender)]
-
-            # run the gaussian process regression
-            x_future, x_full, y_full_mean, y_full_sigma  = run_gaussian_process_regression(name_data)
-
-            # recapitalise the name for output 
-            display_name = name.capitalize()
-
-            # use dark theme
-            plt.style.use('dark_background')
-
-            tab1, tab2, tab3 = st.tabs(["Statistics", "Graph", "Predictions"])
-            with tab1:
-                st.header("Statistics")
-                # get the stats for the selected name 
-                # check whether the name made the list in 2023
-                if 2023 in name_data['Year'].values:
-                    # what was the ranking of the name in 2023
-                    rank_2023 = name_data.loc[name_data['Year'] == 2023]['Rank'].values[0]
-                    # how many of that name were there in 2023
-                    number_2023 = name_data.loc[name_data['Year'] == 2023]['Number'].values[0]
-                    
-                    st.write(f":red[{display_name}] was ranked :red[{rank_2023}] in 2023, :red[{number_2023}] babies were called this." )
-                
-                else:
-                    # when was the last year the name was in the top 100
-                    year_last = name_data['Year'].max()
-                    # what was the ranking of the name in the last year
-                    rank_last = name_data.loc[name_data['Year'] == year_last]['Rank'].values[0]
-                
-                    st.write(f":red[{display_name}] was last in the top 100 in {year_last} when it was ranked {rank_last}.")
-                
-                # total number of babies with that name
-                total = name_data['Number'].sum()
-
-                # how many unique years are there in the dataset?
-                unique_years = name_data['Year'].nunique()
-
-                # average number of babies with that name per year
-                n_years = 72 # 1952-2023
-                mean = total / 72 
-
-                st.write(f"On average :red[{int(mean)}] babies were named :red[{display_name}] in NSW each year over the past {n_years} years.")
-
-                # it was most popular in which year
-                max_year = name_data.loc[name_data['Rank'].idxmin()]['Year']
-                # what was the highest ranking of that name
-                max_rank = name_data.loc[name_data['Rank'].idxmin()]['Rank']
-                
-                st.write(f":red[{display_name}] was most popular in {max_year}, when it was ranked {max_rank}.")
-                
-                # future stats
-                # what does the model think 
-                    
-                if 2023 in name_data['Year'].values:
-                    st.write(f"⚠️ :red[Warning, prediction optimizer in flux:]")
-                        # future stats
-                    # how many babies are predicted to be named that in 2033
-                    future_number = y_full_mean[-10]
-                
-                    # difference between 2023 and 2033
-                    ratio = future_number/number_2023
-                
-                    # what does this ratio mean?
-                    # if ratio is approximately 1 then the name is likely to stay the same
-                    # if ratio is less than 1 then the name is likely to decrease in popularity
-                    # if ratio is greater than 1 then the name is likely to increase in popularity
-                
-                    if ratio > 0.9 and ratio < 1.1:
-                        st.write(f"The number of babies named {display_name} in the future is likely to stay about the same.")
-                
-                    elif ratio < 0.9:
-                        st.write(f"The number of babies named :red[{display_name}] in the future is likely to decrease.")
-                
-                    elif ratio > 1.1:
-                        st.write(f"The number of babies named :red[{display_name}] in the future is likely to increase.")
-                
-                    #st.write(f":red[R = {ratio}]")
-                
-                else:
-                    st.write(f":red[{display_name}] wasn't in the top 100 names last year, should be safe to use. ")
-                
-                
-                        
-
-
-            with tab2:
-                st.header(display_name+" over time")
-                # plot the name prevalence over time 
-                plt.figure()
-                
-                fig, ax = plt.subplots()
-                
-                ax.plot(name_data['Year'], name_data['Number'], color='white')
-                
-                ax.set_xlabel('Year')
-                ax.set_ylabel('Number')
-                
-                st.pyplot(fig)
-
-
-            with tab3:
-                
-                st.header("Predictions for "+display_name)
-                # plot the name prevalence over time with the fit and prediction
-                plt.figure()
-                
-                fig, ax = plt.subplots()
-                
-                ax.plot(name_data['Year'], name_data['Number'], label='Data', color='white')
-                ax.plot(x_full, y_full_mean, 'lightcoral', label='Prediction')
-                #ax.fill_between(x_full.ravel(), y_full_mean - 1.96 * y_full_sigma, 
-                #            y_full_mean + 1.96 * y_full_sigma, alpha=0.2, color='blue')
-                
-                ax.set_xlabel('Year')
-                ax.set_ylabel('Number')
-                ax.legend()
-                
-                st.pyplot(fig)
+def check_year(key):
+    # the Check a year tab: the top names for a year, for each gender
+    dataset = queries.dataset(key)
 
+    year_select = st.text_input("What year do you want to check?", str(dataset.latest_year), key=f'year_{key}')
+    st.write(f"Currently checking :red[{year_select}]")
 
-        else:
-            st.write('That name has never been in the top 100, it must be unique 😲')
+    # how many names to show, up to as many as the dataset keeps
+    top_n = st.selectbox("How many names?", [n for n in TOP_N_CHOICES if n <= dataset.top_n], key=f'top_n_{key}')
+
+    # grab the top names for the selected year, already in rank order
+    with timing.span('top n', dataset=key, n=top_n):
+        male_top = queries.top_n(key, int(year_select), 'M', top_n)
+        female_top = queries.top_n(key, int(year_select), 'F', top_n)
 
-    with tab_history: 
+    tab_female, tab_male = st.tabs(["Female names", "Male names"])
 
-        file = 'popular_baby_names_1952_to_2023.csv'
+    with tab_female:
+        # display the top names 
+        st.write(f"Top {top_n} female names for the year {year_select}")
+        st.dataframe(table(female_top), hide_index=True) 
 
-        year_select = st.text_input("What year do you want to check?", "2023")
-        st.write(f"Currently checking :red[{year_select}]")
+    with tab_male:
+        st.write(f"Top {top_n} male names for the year {year_select}")
+        st.dataframe(table(male_top), hide_index=True) 
 
-        # split the data into male and female
-        df_male = df[df['Gender'] == 'Male']
-        df_female = df[df['Gender'] == 'Female']
 
+def show_forecast(key, name, prediction, outlook, chart, name_data, display_name, number_latest):
+    """Fill in the parts of a Check a name tab that need the forecast.
 
-        # grab the top 10 male names for the selected year
-        df_male_top = df_male[df_male['Year'] == int(year_select)]
-        df_female_top = df_female[df_female['Year'] == int(year_select)]
+    Called at the end of the page, so the statistics and graphs are already
+    showing while the fits run, and the fits for both tabs run together.
+    """
+    with timing.span('forecast wait', dataset=key, name=name):
+        prediction.result()
 
-        df_male_top = df_male_top.sort_values('Rank', ascending=True)
-        df_female_top = df_female_top.sort_values('Rank', ascending=True)
+    if outlook is not None:
+        with outlook.container():
+            # the forecast ten years on against the latest year: about the same, less or more
+            ratio, direction = queries.outlook(prediction.result(), number_latest)
 
-        df_male_top = df_male_top.head(10)
-        df_female_top = df_female_top.head(10)
+            if direction == 'same':
+                st.write(f"The number of babies named {display_name} in the future is likely to stay about the same.")
 
+            else:
+                st.write(f"The number of babies named :red[{display_name}] in the future is likely to {direction}.")
 
-        tab_female, tab_male = st.tabs(["Female names", "Male names"])
+            #st.write(f":red[R = {ratio}]")
 
-        with tab_female:
+    # plot the name prevalence over time with the fit and prediction
+    if interactive:
+        chart.line_chart(charts.prediction_series(name_data, prediction.result()))
+    else:
+        chart.image(charts.prediction_png(key, name, name_data, prediction.result(), forecast.ENGINES[engine].config_key()))
 
-            # display the top ten names 
-            st.write(f"Top 10 female names for the year {year_select}")
-            st.dataframe(df_female_top[['Rank', 'Name', 'Number']], hide_index=True) 
 
-        with tab_male:
-            st.write(f"Top 10 male names for the year {year_select}")
-            st.dataframe(df_male_top[['Rank', 'Name', 'Number']], hide_index=True) 
+# the most names that can be compared at once
+MAX_COMPARE = 5
 
-with tab_us:
 
-    tab_check, tab_history, tab_pick = st.tabs(["Check a name", "Check a year", "Pick a name"])
-
-    with tab_check:
-
-        # names are in first column
-        # make all the names lower case
-        df_us['Name'] = df_us['Name'].str.lower()
-
-        # group the data 
-        grouped = df_us.groupby('Name')
-
-        # what name do you want to check? 
-        # ask the user to input a name
-        name = st.text_input("What name do you want to check?", "Harvey")
-        st.write(f"Currently checking :red[{name}]")
-
-        #gender = st.text_input("What gender statistics do you want to see?", "Male")
-        #st.write("The current gender is", gender)
-
-        # make the name lower case
-        name = name.lower()
-
-        # check if the name is in the list
-        if name in grouped.groups:
-            st.write('That name is in the top 1000. Scroll down for statistics, graphs, and predictions...')
-
-            # get the data for the name
-            name_data = grouped.get_group(name)
-
-            # Alternatively, if you need to filter by both name and gender:
-            #name_data = grouped[(grouped['Name'] == name) & (grouped['Gender'] == gender)]
-
-            # run the gaussian process regression
-            x_future, x_full, y_full_mean, y_full_sigma  = run_gaussian_process_regression(name_data)
-
-            # recapitalise the name for output 
-            display_name = name.capitalize()
-
-            # use dark theme
-            plt.style.use('dark_background')
-
-            tab4, tab5, tab6 = st.tabs(["Statistics", "Graph", "Predictions"])
-            with tab4:
-                st.header("Statistics")
-                # get the stats for the selected name 
-                # check whether the name made the list in 2023
-                if 2023 in name_data['Year'].values:
-                    # calculate the ranking of the name in 2023
-                    # isolate name data for 2023
-                    name_data_2023 = name_data[name_data['Year'] == 2023]
-                    # calculate the rank of the name in 2023
-                    rank_2023 = name_data_2023['Rank'].values[0]
-                    # calculate the number of babies with that name in 2023
-                    number_2023 = name_data.loc[name_data['Year'] == 2023]['Number'].values[0]
-                    
-                    st.write(f":red[{display_name}] was ranked :red[{rank_2023}] in 2023 :red[{number_2023}] babies were called this." )
-                
-                else:
-                    # when was the last year the name was in the top 100
-                    year_last = name_data['Year'].max()
-                    # what was the ranking of the name in the last year
-                    rank_last = name_data.loc[name_data['Year'] == year_last]['Rank'].values[0]
-                
-                    st.write(f":red[{display_name}] was last in the top 1000 in {year_last} when it was ranked {rank_last}.")
-                
-                # total number of babies with that name
-                total = name_data['Number'].sum()
-
-                # how many unique years are there in the dataset?
-                unique_years = name_data['Year'].nunique()
-
-                # average number of babies with that name per year
-                n_years = 2023-1880 # 1952-2023
-                mean = total / n_years
-
-                st.write(f"On average :red[{int(mean)}] babies were named :red[{display_name}] in the US each year over the past {n_years} years.")
-
-                # it was most popular in which year
-                max_year = name_data.loc[name_data['Number'].idxmin()]['Year']
-                # what was the highest ranking of that name
-                # max_ = name_data.loc[name_data['Rank'].idxmin()]['Rank']
-                
-                st.write(f":red[{display_name}] was most popular in {max_year}.")
-                
-                # future stats
-                # what does the model think 
-                    
-                if 2023 in name_data['Year'].values:
-                    st.write(f"⚠️ :red[Warning, prediction optimizer in flux:]")
-                        # future stats
-                    # how many babies are predicted to be named that in 2033
-                    future_number = y_full_mean[-10]
-                
-                    # difference between 2023 and 2033
-                    ratio = future_number/number_2023
-                
-                    # what does this ratio mean?
-                    # if ratio is approximately 1 then the name is likely to stay the same
-                    # if ratio is less than 1 then the name is likely to decrease in popularity
-                    # if ratio is greater than 1 then the name is likely to increase in popularity
-                
-                    if ratio > 0.9 and ratio < 1.1:
-                        st.write(f"The number of babies named {display_name} in the future is likely to stay about the same.")
-                
-                    elif ratio < 0.9:
-                        st.write(f"The number of babies named :red[{display_name}] in the future is likely to decrease.")
-                
-                    elif ratio > 1.1:
-                        st.write(f"The number of babies named :red[{display_name}] in the future is likely to increase.")
-                
-                    #st.write(f":red[R = {ratio}]")
-                
-                else:
-                    st.write(f":red[{display_name}] wasn't in the top 100 names last year, should be safe to use. ")
-                
-                
-                        
-
-
-            with tab5:
-                st.header(display_name+" over time")
-                # plot the name prevalence over time 
-                plt.figure()
-                
-                fig, ax = plt.subplots()
-                
-                ax.plot(name_data['Year'], name_data['Number'], color='white')
-                
-                ax.set_xlabel('Year')
-                ax.set_ylabel('Number')
-                
-                st.pyplot(fig)
-
-
-            with tab6:
-                
-                st.header("Predictions for "+display_name)
-                # plot the name prevalence over time with the fit and prediction
-                plt.figure()
-                
-                fig, ax = plt.subplots()
-                
-                ax.plot(name_data['Year'], name_data['Number'], label='Data', color='white')
-                ax.plot(x_full, y_full_mean, 'lightcoral', label='Prediction')
-                #ax.fill_between(x_full.ravel(), y_full_mean - 1.96 * y_full_sigma, 
-                #            y_full_mean + 1.96 * y_full_sigma, alpha=0.2, color='blue')
-                
-                ax.set_xlabel('Year')
-                ax.set_ylabel('Number')
-                ax.legend()
-                
-                st.pyplot(fig)
+def compare_names(key, default, engine):
+    """The Compare names tab: several names' histories and forecasts on one chart.
 
+    All the names are looked up in one batch and their forecasts are fitted
+    together, the chart is filled in at the end of the page.
+    """
+    dataset = queries.dataset(key)
+    names_input = st.text_input(f"Which names do you want to compare? Up to {MAX_COMPARE}, separated by commas.",
+                                default, key=f'compare_{key}')
+    names = list(dict.fromkeys(names_data.normalise_name(name) for name in names_input.split(',') if name.strip()))
+    names = names[:MAX_COMPARE]
 
-        else:
-            st.write('That name has never been in the top 100, it must be unique 😲')
+    with timing.span('lookup', dataset=key, names=len(names)):
+        found = lookup_many(dataset, names)
+    for name in names:
+        if found[name] is None:
+            st.write(f":red[{name.capitalize()}] isn't in the {dataset.label} data.")
+            did_you_mean(key, name)
+
+    names = [name for name in names if found[name] is not None]
+    if not names:
+        return
+
+    futures = forecast.submit_forecasts(key, names, [found[name] for name in names], engine=engine)
+
+    chart = st.empty()
+    chart.write("Working out the predictions...")
+    pending.append(partial(show_comparison, key, chart, names, found, futures, engine))
 
-    with tab_history: 
 
-        year_select_us = st.text_input("What year do you want to check?", "2022")
-        st.write(f"Currently checking :red[{year_select_us}]")
+def show_comparison(key, chart, names, found, futures, engine):
+    # every name's history and prediction on the one chart
+    series = [found[name] for name in names]
+    with timing.span('forecast wait', dataset=key, names=len(names)):
+        predictions = [future.result() for future in futures]
 
-        # split the data into male and female
-        df_male = df_us[df_us['Gender'] == 'M']
-        df_female = df_us[df_us['Gender'] == 'F']
+    if interactive:
+        chart.line_chart(charts.comparison_series(names, series, predictions))
+    else:
+        chart.image(charts.comparison_png(key, names, series, predictions, forecast.ENGINES[engine].config_key()))
 
 
-        # grab the top 10 male names for the selected year
-        df_male_top = df_male[df_male['Year'] == int(year_select_us)]
-        df_female_top = df_female[df_female['Year'] == int(year_select_us)]
+# what the Trending tabs can rank by
+TREND_METRICS = {
+    'slope': "Growth over the last ten years",
+    'acceleration': "Growth picking up (or slowing down)",
+    'forecast_ratio': "Predicted growth over the next ten years",
+}
 
-        df_male_top = df_male_top.sort_values('Rank', ascending=True)
-        df_female_top = df_female_top.sort_values('Rank', ascending=True)
 
-        df_male_top = df_male_top.head(10)
-        df_female_top = df_female_top.head(10)
+def trending_names(key):
+    # the names rising or falling fastest, straight from the precomputed trend index
+    dataset = queries.dataset(key)
 
+    gender = st.radio("Female or male names?", ["Female", "Male"], key=f'trend_gender_{key}')
+    rising = st.radio("Which way?", ["Rising", "Falling"], key=f'trend_direction_{key}') == "Rising"
+    by = st.selectbox("Ranked by", list(TREND_METRICS), format_func=TREND_METRICS.get, key=f'trend_by_{key}')
 
-        tab_female, tab_male = st.tabs(["Female names", "Male names"])
+    with timing.span('trending', dataset=key, by=by):
+        top = queries.trending(key, gender[0], 20, by, rising)
+    top['name'] = [name.capitalize() for name in top['name']]
+    st.write(f"The 20 {gender.lower()} names {'rising' if rising else 'falling'} fastest "
+             f"in {dataset.label} up to {dataset.latest_year}")
+    del top['gender']
+    st.dataframe(table(top), hide_index=True)
 
-        with tab_female:
 
-            # display the top ten names 
-            st.write(f"Top 10 female names for the year {year_select_us}")
-            st.dataframe(df_female_top[['Rank', 'Name', 'Number']], hide_index=True) 
+def pick_name(key):
+    # the Pick a name tab: random names, narrowed down by however many filters are set
+    st.write("We will pick a random name for you to consider...")
 
-        with tab_male:
-            st.write(f"Top 10 male names for the year {year_select_us}")
-            st.dataframe(df_male_top[['Rank', 'Name', 'Number']], hide_index=True) 
+    # are you looking for a male or female name?
+    gender = st.radio("Do you want a typically male or female name?", ["Male", "Female"], key=f'pick_gender_{key}')
 
-    with tab_pick:
+    # narrow it down, every filter is optional
+    band = st.selectbox("How popular has it been at its best?", list(RANK_BANDS), index=list(RANK_BANDS).index('Top 1000'),
+                        key=f'pick_band_{key}')
+    era = st.selectbox("When was it most popular?", [None] + queries.picker(key).eras,
+                       format_func=lambda era: 'Any time' if era is None else f'{era}s', key=f'pick_era_{key}')
+    trend = st.selectbox("Where is it heading?", [None] + TRENDS,
+                         format_func=lambda trend: 'Anywhere' if trend is None else trend.capitalize(), key=f'pick_trend_{key}')
+    weighted = st.checkbox("Favour more popular names", key=f'pick_weighted_{key}')
 
-        st.write("We will pick a random name for you to consider...")
-        
-        # are you looking for a male or female name?
-        gender = st.radio("Do you want a typically male or female name?", ["Male", "Female"])
+    # select three different random names
+    random_names = queries.random_names(key, gender[0], k=3, weighted=weighted, band=band, era=era, trend=trend)
 
+    # capitalise the names
+    random_names = [random_name.capitalize() for random_name in random_names]
 
-        # select a random name from the list
-        if gender == 'Male':
+    if len(random_names) == 3:
+        st.write(f"How about: {random_names[0]}, {random_names[1]}, or {random_names[2]}?")
+    elif random_names:
+        st.write(f"Only a few names fit: {', '.join(random_names)}.")
+    else:
+        st.write("No names fit all of those, try loosening one of them.")
 
-            # select male names
-            df_male = df_us[df_us['Gender'] == 'M']
 
-            # how many unique names?
-            unique_names = df_male['Name'].unique()
+# forecasts still being fitted, and how to show each one once it's done
+pending = []
 
-            length = len(unique_names)
 
-            # get a random number between 0 and length
-            random_n1 = np.random.randint(0, length)
-            random_n2 = np.random.randint(0, length)
-            random_n3 = np.random.randint(0, length)
+###### end functions ####### 
 
-            # select the name at that index
-            random_name1 = unique_names[random_n1]
-            random_name2 = unique_names[random_n2]
-            random_name3 = unique_names[random_n3]
+###### app text ######
 
-        if gender == 'Female':
+st.set_page_config(page_title="Name Check 📈")
+st.title("Name Check 📈")
+st.header(":red[Welcome to the Name Check App!]")
+st.subheader("Need to name a child? Want to know more about your name? You're in the right place!")
+#st.markdown("As a Rebecca born in the 90s I am acutely aware of *how annoying* it can be to have an extremely common name. With this app you can check how **common prospective names are at the moment**, how common they were in the **past**, and whether they are about to be **trending**.")
+
+st.text("This app is maintained by R. McElroy and uses census data from the NSW & US Government.")
+st.page_link("https://rebeccamcelroy.github.io/", label="Rebecca's Homepage", icon="🏠")
 
-            # select male names
-            df_female = df_us[df_us['Gender'] == 'F']
+# which forecasting engine to use for the predictions
+engine = st.sidebar.radio("Prediction model", list(forecast.ENGINES), format_func=str.capitalize,
+                          help="Accurate fits a Gaussian process to each name, fast fits a damped trend in a fraction of the time.")
 
-            # how many unique names?
-            unique_names = df_female['Name'].unique()
+# charts are pre-rendered images by default, interactive ones are drawn in the browser from the raw numbers
+interactive = st.sidebar.checkbox("Interactive charts")
 
-            length = len(unique_names)
+# how long each stage of this run took, shown at the bottom of the page
+show_timings = st.sidebar.checkbox("Show timings", value=timing.ENABLED)
+timing.start_run(show_timings)
+if timing.METRICS_PORT:
+    metrics_server(timing.METRICS_PORT)
 
-            # get a random number between 0 and length
-            random_n1 = np.random.randint(0, length)
-            random_n2 = np.random.randint(0, length)
-            random_n3 = np.random.randint(0, length)
+# only the open tab runs, so a dataset, and whatever its tabs need, is loaded
+# the first time someone looks at it rather than on every visit
+tab_aus, tab_us = st.tabs(["Australia - NSW", "USA"], key='dataset', on_change='rerun')
 
-            # select the name at that index
-            random_name1 = unique_names[random_n1]
-            random_name2 = unique_names[random_n2]
-            random_name3 = unique_names[random_n3]
-            
+with tab_aus:
+    if tab_aus.open:
 
-        # capitalise the name
-        random_name1 = random_name1.capitalize()
-        random_name2 = random_name2.capitalize()
-        random_name3 = random_name3.capitalize()
+        tab_check, tab_history, tab_compare, tab_trending = st.tabs(["Check a name", "Check a year", "Compare names", "Trending"],
+                                                                    key='nsw_tab', on_change='rerun')
 
-            
-        st.write(f"How about: {random_name1}, {random_name2}, or {random_name3}?")
+        with tab_check:
+            if tab_check.open:
+                check_name('nsw', "James", engine)
+
+        with tab_history: 
+            if tab_history.open:
+                check_year('nsw')
+
+        with tab_compare:
+            if tab_compare.open:
+                compare_names('nsw', "Olivia, Amelia, Isla", engine)
+
+        with tab_trending:
+            if tab_trending.open:
+                trending_names('nsw')
+
+with tab_us:
+    if tab_us.open:
+
+        # every row of the yobYYYY.txt files is kept, the top 1000 cut is made when the data is used
+        tab_check, tab_history, tab_compare, tab_trending, tab_pick = st.tabs(
+            ["Check a name", "Check a year", "Compare names", "Trending", "Pick a name"], key='us_tab', on_change='rerun')
+
+        with tab_check:
+            if tab_check.open:
+                check_name('us', "Harvey", engine)
+
+        with tab_history: 
+            if tab_history.open:
+                check_year('us')
+
+        with tab_compare:
+            if tab_compare.open:
+                compare_names('us', "Olivia, Emma, Charlotte", engine)
+
+        with tab_trending:
+            if tab_trending.open:
+                trending_names('us')
+
+        with tab_pick:
+            if tab_pick.open:
+                pick_name('us')
 
 
 # with tab4:
@@ -578,6 +410,12 @@ with tab_us:
 #     st.plotly_chart(fig, theme="streamlit")
 
 
+###### predictions ######
 
+# the forecasts were started as each tab was drawn, now wait for them and fill them in
+for show in pending:
+    show()
 
-
+if show_timings:
+    with st.expander("Timings for this run", expanded=True):
+        st.dataframe(timing.run_table(), hide_index=True)
@@ -0,0 +1,29 @@
+# a dataset small enough to work out by hand
+
+import pandas as pd
+import pytest
+
+from name_index import CountMatrix, NameIndex, YearIndex
+from names_data import NameDataset, normalise_frame
+
+
+ROWS = [
+    # year, gender, name, babies, rank
+    (2019, 'Female', 'Ava', 30, 1),
+    (2019, 'Female', 'Alex', 10, 2),
+    (2019, 'Male', 'Alex', 20, 1),
+    (2019, 'Male', 'Ben', 5, 2),
+    (2020, 'Female', 'Ava', 40, 1),
+    (2020, 'Female', 'Cleo', 40, 2),
+    (2020, 'Male', 'Ben', 25, 1),
+    (2020, 'Male', 'Alex', 15, 2),
+    (2021, 'Female', 'Cleo', 60, 1),
+    (2021, 'Male', 'Ben', 30, 1),
+]
+
+
+@pytest.fixture
+def tiny():
+    frame = pd.DataFrame(ROWS, columns=['Year', 'Gender', 'Name', 'Number', 'Rank'])
+    frame = normalise_frame(frame.astype({'Year': 'int16', 'Number': 'int32', 'Rank': 'int32'}))
+    return NameDataset('nsw', frame, NameIndex(frame), YearIndex(frame), CountMatrix(frame))
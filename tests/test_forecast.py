@@ -0,0 +1,41 @@
+# the forecast table: one row per forecast, read back one at a time
+
+import numpy as np
+
+import forecast
+
+
+def prediction(last_year=2023, projection_years=3):
+    x_full = np.arange(2015, last_year + projection_years + 1).reshape(-1, 1)
+    mean = np.linspace(100, 50, len(x_full))
+    return x_full[-projection_years:], x_full, mean, mean / 10
+
+
+def test_table_round_trip(tmp_path):
+    path = tmp_path / 'forecasts.sqlite'
+    assert forecast.precomputed_forecast('nsw', 'olivia', path=path) is None
+    assert not path.exists()
+
+    written = prediction()
+    forecast.write_forecasts([forecast.forecast_to_row('nsw', 'olivia', None, 3, forecast.KERNEL_CONFIG, written)], path)
+    read = forecast.precomputed_forecast('nsw', 'olivia', projection_years=3, path=path)
+    for a, b in zip(written, read):
+        np.testing.assert_allclose(a, b, rtol=1e-6)
+
+    # another gender, horizon or kernel is another forecast
+    assert forecast.precomputed_forecast('nsw', 'olivia', 'F', projection_years=3, path=path) is None
+    assert forecast.precomputed_forecast('nsw', 'olivia', projection_years=20, path=path) is None
+    assert forecast.table_keys(path) == {forecast.table_key('nsw', 'olivia', None, 3)}
+
+
+def test_invalidate_deletes_rows(tmp_path):
+    path = tmp_path / 'forecasts.sqlite'
+    rows = [forecast.forecast_to_row(key, name, gender, 20, forecast.KERNEL_CONFIG, prediction(projection_years=20))
+            for key in ('nsw', 'us') for name in ('olivia', 'oliver') for gender in (None, 'F')]
+    forecast.write_forecasts(rows, path)
+
+    forecast.invalidate('nsw', {'olivia'}, path)
+    assert {key[:2] for key in forecast.table_keys(path)} == {('nsw', 'oliver'), ('us', 'olivia'), ('us', 'oliver')}
+
+    forecast.invalidate('us', None, path)
+    assert {key[:2] for key in forecast.table_keys(path)} == {('nsw', 'oliver')}
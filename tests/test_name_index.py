@@ -0,0 +1,50 @@
+# the per-name statistics the count matrix works out for every name at once
+
+import numpy as np
+
+from name_index import lookup
+
+
+def test_stats_row_per_name_and_gender(tiny):
+    stats = tiny.matrix.stats.set_index(['Name', 'Gender'])
+    assert sorted(stats.index) == [('alex', 'F'), ('alex', 'M'), ('ava', 'F'), ('ben', 'M'), ('cleo', 'F')]
+
+    ava = stats.loc[('ava', 'F')]
+    assert (ava['Total'], ava['FirstYear'], ava['LastYear'], ava['LastRank']) == (70, 2019, 2020, 1)
+    assert (ava['BestRank'], ava['BestYear'], ava['PeakYear']) == (1, 2019, 2020)
+    # not recorded in the latest year
+    assert (ava['LatestRank'], ava['LatestNumber']) == (0, 0)
+
+    cleo = stats.loc[('cleo', 'F')]
+    assert (cleo['BestRank'], cleo['BestYear'], cleo['LatestRank'], cleo['LatestNumber']) == (1, 2021, 1, 60)
+
+
+def test_series_is_the_matrix_row(tiny):
+    matrix = tiny.matrix
+    np.testing.assert_array_equal(matrix.years, [2019, 2020, 2021])
+    np.testing.assert_array_equal(matrix.series('ben', 'M'), [5, 25, 30])
+    np.testing.assert_array_equal(matrix.series('alex', 'F'), [10, 0, 0])
+    assert matrix.series('ben', 'F') is None
+
+
+def test_name_stats_without_a_gender_covers_both(tiny):
+    stats = tiny.matrix.name_stats('alex')
+    # described by the boys, who had more of them
+    assert stats['Gender'] == 'M'
+    assert (stats['Total'], stats['BestRank'], stats['LatestNumber']) == (45, 1, 0)
+    assert tiny.matrix.name_stats('alex', 'F')['Total'] == 10
+    assert tiny.matrix.name_stats('zed') is None
+
+
+def test_gender_split_and_shares(tiny):
+    split = tiny.matrix.gender_split('alex')
+    assert (split['Female'], split['Male'], split['Both'], split['Unisex']) == (10, 35, True, True)
+    assert tiny.matrix.gender_split('ava')['Both'] is False
+    np.testing.assert_allclose(tiny.matrix.female_share('alex'), [1 / 3, 0, np.nan])
+    np.testing.assert_allclose(tiny.matrix.female_share('ben'), [0, 0, 0])
+
+
+def test_lookup_max_rank_keeps_the_years_ranked_that_high(tiny):
+    assert lookup(tiny, 'ben', 'M')['Year'].tolist() == [2019, 2020, 2021]
+    assert lookup(tiny, 'ben', 'M', max_rank=1)['Year'].tolist() == [2020, 2021]
+    assert lookup(tiny, 'alex', 'F', max_rank=1) is None
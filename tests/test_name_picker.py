@@ -0,0 +1,38 @@
+# random names: the alias table draws in proportion, the picker never repeats a name
+
+import numpy as np
+
+from name_picker import AliasTable, NamePicker
+
+
+def test_alias_table_draws_in_proportion():
+    weights = np.array([1, 2, 7, 0])
+    draws = AliasTable(weights).draw(np.random.default_rng(0), 100_000)
+    np.testing.assert_allclose(np.bincount(draws, minlength=4) / len(draws), weights / weights.sum(), atol=0.01)
+
+
+def test_pick_never_repeats_a_name(tiny):
+    picker = NamePicker(tiny)
+    rng = np.random.default_rng(0)
+    for weighted in (False, True):
+        for k in (1, 2, 3):
+            picked = picker.pick(k=k, weighted=weighted, rng=rng)
+            assert len(picked) == len(set(picked)) == k
+
+
+def test_pick_more_than_there_are(tiny):
+    picker = NamePicker(tiny)
+    rng = np.random.default_rng(0)
+    # alex is a row for each gender but only one name
+    assert sorted(picker.pick(k=10, rng=rng)) == ['alex', 'ava', 'ben', 'cleo']
+    assert sorted(picker.pick(k=10, weighted=True, rng=rng)) == ['alex', 'ava', 'ben', 'cleo']
+    assert sorted(picker.pick('M', k=10, rng=rng)) == ['alex', 'ben']
+
+
+def test_pick_filters(tiny):
+    picker = NamePicker(tiny)
+    rng = np.random.default_rng(0)
+    assert picker.eras == [2010, 2020]
+    assert picker.pick(era=2010, k=3, rng=rng) == ['alex']
+    assert picker.pick('M', era=2020, k=3, rng=rng) == ['ben']
+    assert picker.pick('F', band='Outside the top 1000', rng=rng) == []
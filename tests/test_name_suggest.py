@@ -0,0 +1,31 @@
+# "did you mean" from the deletion dictionary gives what checking every name would
+
+import numpy as np
+
+import names_data
+from name_suggest import SuggestionIndex, edit_distance, linear_suggest, typo
+
+
+def test_edit_distance():
+    assert edit_distance('olivia', 'olivia') == 0
+    assert edit_distance('olivia', 'olviia') == 1
+    assert edit_distance('olivia', 'oliver') == 2
+    # further than max_distance is capped
+    assert edit_distance('olivia', 'amelia') == 3
+
+
+def test_suggest_ranks_by_distance_then_babies():
+    index = SuggestionIndex(['olivia', 'olive', 'oliver', 'amelia'], [100, 10, 50, 80])
+    assert index.suggest('Olivai') == ['olivia', 'oliver', 'olive']
+    assert index.suggest('olivia', k=2) == ['olivia', 'oliver']
+    assert index.suggest('amelai') == ['amelia']
+    assert index.suggest(' ') == []
+
+
+def test_suggest_matches_a_linear_scan():
+    names = sorted(names_data.load_source_frame('nsw')['Name'].unique())
+    index = SuggestionIndex(names, np.arange(len(names)))
+    rng = np.random.default_rng(0)
+    for name in rng.choice(names, 50):
+        query = typo(name, rng)
+        assert index.suggest(query) == linear_suggest(index, query)
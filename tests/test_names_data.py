@@ -0,0 +1,20 @@
+# ranks worked out from the numbers, as they are for the US files
+
+import numpy as np
+
+from names_data import rank_names
+
+
+def test_rank_names_matches_the_published_ranks(tiny):
+    frame = tiny.frame
+    ranks = rank_names(frame['Year'].to_numpy(), frame['Gender'].cat.codes.to_numpy(), frame['Number'].to_numpy(),
+                       frame['Name'].cat.codes.to_numpy())
+    np.testing.assert_array_equal(ranks, frame['Rank'])
+
+
+def test_rank_names_breaks_ties_alphabetically():
+    years = np.array([2000, 2000, 2000, 2000])
+    genders = np.array([0, 0, 0, 1])
+    numbers = np.array([5, 9, 5, 1])
+    names = np.array([2, 0, 1, 2])
+    np.testing.assert_array_equal(rank_names(years, genders, numbers, names), [3, 1, 2, 1])
@@ -0,0 +1,101 @@
+# a reloaded dataset throws away the forecasts made from the old copy of any name that changed
+
+import numpy as np
+import pytest
+
+import forecast
+import names_data
+import queries
+
+
+@pytest.fixture
+def nsw(monkeypatch, tmp_path):
+    # the NSW data loaded from its csv, with the forecast table and the query caches to ourselves
+    invalidate = forecast.invalidate
+    monkeypatch.setattr(forecast, 'invalidate', lambda key, names=None: invalidate(key, names, tmp_path / 'forecasts.sqlite'))
+    monkeypatch.setattr(queries, 'RECHECK_SECONDS', 0)
+    monkeypatch.setattr(queries, '_datasets', {})
+    monkeypatch.setattr(queries, '_derived', {})
+    monkeypatch.setattr(names_data, 'snapshot_is_fresh', lambda key: False)
+    monkeypatch.setattr(names_data, 'snapshot_manifest', lambda key: None)
+    forecast.forecast_cache.clear()
+    yield names_data.load_source_frame('nsw')
+    forecast.forecast_cache.clear()
+
+
+def test_csv_load_says_everything_may_have_changed(nsw):
+    assert names_data.load_dataset('nsw', source='csv').updated is None
+    assert names_data.load_dataset('nsw').updated is None
+
+
+def tripled(frame, name='olivia', year=2023):
+    # the same data with one of a name's counts changed
+    frame = frame.copy()
+    frame.loc[(frame['Name'] == name) & (frame['Year'] == year), 'Number'] *= 3
+    return frame
+
+
+def test_csv_reload_invalidates_the_names_that_changed(nsw, monkeypatch):
+    invalidated = []
+    monkeypatch.setattr(forecast, 'invalidate', lambda key, names=None: invalidated.append((key, names)))
+
+    signature = [('popular_baby_names.csv', 1)]
+    monkeypatch.setattr(names_data, 'source_signature', lambda key: tuple(signature))
+    first = queries.dataset('nsw')
+    # the first load has nothing to throw away
+    assert invalidated == []
+
+    # touched but not changed
+    signature[0] = ('popular_baby_names.csv', 2)
+    assert queries.dataset('nsw') is not first
+    assert invalidated == []
+
+    signature[0] = ('popular_baby_names.csv', 3)
+    monkeypatch.setattr(names_data, 'load_source_frame', lambda key: tripled(nsw))
+    queries.dataset('nsw')
+    assert invalidated == [('nsw', frozenset({'olivia'}))]
+
+
+def test_csv_reload_drops_cached_forecasts(nsw, monkeypatch):
+    signature = [('popular_baby_names.csv', 1)]
+    monkeypatch.setattr(names_data, 'source_signature', lambda key: tuple(signature))
+    queries.forecast_name('nsw', 'olivia', engine='fast')
+    assert len(forecast.forecast_cache) == 1
+
+    signature[0] = ('popular_baby_names.csv', 2)
+    monkeypatch.setattr(names_data, 'load_source_frame', lambda key: tripled(nsw))
+    queries.dataset('nsw')
+    assert len(forecast.forecast_cache) == 0
+
+
+def test_snapshot_updated_elsewhere_drops_cached_forecasts(nsw, monkeypatch):
+    # another process updated the snapshot, this one only sees a fresh snapshot with different rows
+    snapshot = [nsw]
+    signature = [('popular_baby_names.csv', 1)]
+    monkeypatch.setattr(names_data, 'source_signature', lambda key: tuple(signature))
+    monkeypatch.setattr(names_data, 'snapshot_is_fresh', lambda key: True)
+    monkeypatch.setattr(names_data, 'read_snapshot', lambda key: snapshot[0])
+    before = queries.forecast_name('nsw', 'olivia', engine='fast')
+    queries.forecast_name('nsw', 'charlotte', engine='fast')
+    assert len(forecast.forecast_cache) == 2
+
+    snapshot[0] = tripled(nsw)
+    signature[0] = ('popular_baby_names.csv', 2)
+    assert queries.dataset('nsw').updated == frozenset()
+    assert len(forecast.forecast_cache) == 1
+    after = queries.forecast_name('nsw', 'olivia', engine='fast')
+    assert not np.array_equal(after['mean'], before['mean'])
+
+
+def test_snapshot_is_swapped_in_whole(nsw, tmp_path):
+    snapshot_dir = tmp_path / 'snapshot'
+    sources = [('popular_baby_names.csv', 1)]
+    for rows in (None, 200, 100):
+        names_data.write_snapshot('nsw', nsw.iloc[:rows], snapshot_dir, sources)
+
+    assert len(names_data.read_snapshot('nsw', snapshot_dir)) == 100
+    # the link, the folder it points at and the one it was swapped from, the oldest is gone
+    assert sorted(path.is_symlink() for path in snapshot_dir.iterdir()) == [False, False, True]
+    assert {len(np.load(path / 'Number.npy')) for path in snapshot_dir.iterdir()} == {100, 200}
+    assert all(path.stat().st_mode & 0o777 == 0o755 for path in snapshot_dir.iterdir())
+    np.testing.assert_array_equal(names_data.read_snapshot('nsw', snapshot_dir)['Number'], nsw['Number'][:100])
@@ -0,0 +1,168 @@
+# timing spans around the name check app's hot paths
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+
+# NAMECHECK_TIMING=1 times every run and logs every span, otherwise only runs
+# that ask for it (the app's "Show timings" box) are timed
+ENABLED = os.environ.get('NAMECHECK_TIMING', '') not in ('', '0')
+
+# port for the Prometheus style /metrics endpoint, off when unset
+METRICS_PORT = int(os.environ.get('NAMECHECK_METRICS_PORT') or 0) or None
+
+# histogram buckets in seconds, from a dict lookup up to a cold GP fit
+BUCKETS = (0.0001, 0.001, 0.01, 0.1, 0.5, 1, 5, 10, 60)
+
+logger = logging.getLogger('namecheck.timing')
+if ENABLED and not logger.handlers:
+    # one JSON object per line on stderr
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# the spans of the run going on in this thread, None when it isn't being timed
+_run = threading.local()
+
+# stage -> [count, total seconds, count per bucket], since the process started
+_totals = {}
+_lock = threading.Lock()
+
+_OFF = contextlib.nullcontext()
+
+
+def start_run(enabled=False):
+    # everything this thread times from now on belongs to a new run
+    _run.spans = [] if enabled or ENABLED else None
+    _run.depth = 0
+    _run.start = time.perf_counter()
+
+
+class _Span:
+    __slots__ = ('stage', 'labels', 'start', 'depth')
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.depth = getattr(_run, 'depth', 0)
+        _run.depth = self.depth + 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        _run.depth = self.depth
+        record(self.stage, seconds, self.depth, **self.labels)
+        return False
+
+
+def span(stage, **labels):
+    """Time a block as one stage of a run.
+
+    When nothing is being timed this is a shared do-nothing context
+    manager, so leaving spans in the hot paths costs a couple of attribute
+    lookups.
+    """
+    if not ENABLED and getattr(_run, 'spans', None) is None:
+        return _OFF
+    return _Span(stage, labels)
+
+
+def record(stage, seconds, depth=0, **labels):
+    # add a finished span to this thread's run, the process totals and the log
+    spans = getattr(_run, 'spans', None)
+    if not ENABLED and spans is None:
+        return
+
+    if spans is not None:
+        spans.append((stage, depth, labels, seconds))
+
+    with _lock:
+        totals = _totals.setdefault(stage, [0, 0.0, [0] * len(BUCKETS)])
+        totals[0] += 1
+        totals[1] += seconds
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                totals[2][i] += 1
+
+    if ENABLED:
+        logger.info(json.dumps({'span': stage, 'ms': round(1000 * seconds, 3), **labels}))
+
+
+def run_table():
+    # this thread's run so far, one row per span in the order they finished
+    spans = getattr(_run, 'spans', None) or []
+    rows = [{'Stage': '  ' * depth + stage,
+             'Details': ', '.join(f'{k}={v}' for k, v in labels.items()),
+             'ms': 1000 * seconds} for stage, depth, labels, seconds in spans]
+    rows.append({'Stage': 'whole run', 'Details': '', 'ms': 1000 * (time.perf_counter() - _run.start)})
+    return pd.DataFrame(rows)
+
+
+###### metrics endpoint ######
+
+def metrics_text():
+    """Every span's totals as a Prometheus histogram, in the text exposition format."""
+    lines = ['# HELP namecheck_span_seconds Time spent in each stage of the app.',
+             '# TYPE namecheck_span_seconds histogram']
+    with _lock:
+        totals = {stage: (count, total, list(buckets)) for stage, (count, total, buckets) in _totals.items()}
+
+    for stage, (count, total, buckets) in sorted(totals.items()):
+        for bound, n in zip(BUCKETS, buckets):
+            lines.append(f'namecheck_span_seconds_bucket{{span="{stage}",le="{bound}"}} {n}')
+        lines.append(f'namecheck_span_seconds_bucket{{span="{stage}",le="+Inf"}} {count}')
+        lines.append(f'namecheck_span_seconds_sum{{span="{stage}"}} {total}')
+        lines.append(f'namecheck_span_seconds_count{{span="{stage}"}} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics_text().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(port=METRICS_PORT, host='127.0.0.1'):
+    # /metrics on a background thread, for a local scraper
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    # python timing.py -> what a span costs when timing is off and when it's on
+    parser = argparse.ArgumentParser(description='Measure the overhead of a timing span.')
+    parser.add_argument('--calls', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    for enabled in [False, True]:
+        start_run(enabled)
+        start = time.perf_counter()
+        for _ in range(args.calls):
+            with span('overhead'):
+                pass
+        elapsed = time.perf_counter() - start
+        print(f"timing {'on' if enabled else 'off'}: {1e9 * elapsed / args.calls:.0f} ns per span")
@@ -0,0 +1,189 @@
+# which names are rising or falling fastest
+
+import argparse
+import copy
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+import names_data
+from forecast import FastForecaster
+
+
+# how many of the latest years the slope and acceleration are fitted over
+WINDOW = 10
+
+# how far ahead the forecast ratio looks, the same ten years the app's outlook uses
+HORIZON = 10
+
+# names with fewer babies than this in the latest year are left out of the rankings
+MIN_COUNT = 50
+
+METRICS = ['slope', 'acceleration', 'forecast_ratio']
+
+
+def year_signatures(dataset):
+    """A hash of the names and numbers in every (year, gender) block, by year.
+
+    A changed file changes its year's signature. Names are hashed by their
+    text, since their codes shift whenever a name is added to the vocabulary.
+    """
+    frame = dataset.years.frame
+    name_hashes = pd.util.hash_array(np.asarray(frame['Name'].cat.categories, dtype=object))
+    names = name_hashes[frame['Name'].cat.codes.to_numpy()]
+    numbers = np.ascontiguousarray(frame['Number'].to_numpy())
+
+    signatures = {}
+    for (year, gender), (start, stop) in dataset.years.blocks.items():
+        block = zlib.crc32(numbers[start:stop].tobytes(), zlib.crc32(names[start:stop].tobytes()))
+        signatures.setdefault(year, []).append((gender, block))
+    return {year: tuple(sorted(signature)) for year, signature in signatures.items()}
+
+
+class TrendIndex:
+    """Slope, acceleration and forecast ratio for every (name, gender).
+
+    Worked out straight from the dataset's count matrix, reading only the
+    latest years the metrics look at, and every metric is worked out for
+    all rows at once. Rankings are sorted once when the index is built, so
+    a "top 20 rising" query is a slice.
+
+    updated() makes an index for a newer copy of the dataset. It keeps the
+    metrics if none of the years they read has changed, and otherwise builds
+    the index again in full: a new year moves every name's window along, so
+    every metric changes with it.
+    """
+
+    def __init__(self, dataset, signatures=None, window=WINDOW, horizon=HORIZON):
+        self.years = dataset.matrix.years
+        self.signatures = year_signatures(dataset) if signatures is None else signatures
+        self.window = window
+        self.horizon = horizon
+
+        self.genders = np.asarray(dataset.matrix.stats['Gender'], dtype=object)
+        self.metrics = self._metrics(dataset.matrix)
+
+        # every row in order of each metric, largest first, rows without a value left out
+        self.order = {}
+        for metric in METRICS:
+            values = self.metrics[metric].to_numpy()
+            order = np.argsort(-values, kind='stable')
+            self.order[metric] = order[~np.isnan(values[order])]
+
+    @classmethod
+    def build(cls, dataset, window=WINDOW, horizon=HORIZON):
+        return cls(dataset, window=window, horizon=horizon)
+
+    @property
+    def span(self):
+        # how many of the latest years the metrics read
+        return min(max(self.window, FastForecaster().window), len(self.years))
+
+    def updated(self, dataset):
+        # an index for a newer copy of the dataset, rebuilt in full if any year the metrics read has changed
+        signatures = year_signatures(dataset)
+        if np.array_equal(dataset.matrix.years, self.years) and \
+                all(signatures.get(year) == self.signatures.get(year) for year in self.years[-self.span:].tolist()):
+            index = copy.copy(self)
+            index.signatures = signatures
+            return index
+        return TrendIndex(dataset, signatures, self.window, self.horizon)
+
+    def _metrics(self, matrix):
+        # the latest years of every (name, gender), in the order of matrix.stats. Each gender's rows
+        # come in that order, so its matrix rows go in as they are
+        stats = matrix.stats
+        years = self.years[-self.span:]
+        counts = np.zeros((len(stats), len(years)), dtype='float32')
+        for gender, gender_counts in matrix.counts.items():
+            counts[self.genders == gender] = gender_counts[:, -len(years):]
+
+        window = min(self.window, len(years))
+        latest = counts[:, -1].astype(float)
+        recent = np.log1p(counts[:, -window:].astype(float))
+        t = (years[-window:] - years[-1]).astype(float)
+
+        # a straight line through the window gives the growth per year, a parabola the change in that growth
+        slope = np.polyfit(t, recent.T, 1)[0] if window > 1 else np.zeros(len(latest))
+        acceleration = 2 * np.polyfit(t, recent.T, 2)[0] if window > 2 else np.zeros(len(latest))
+
+        # the fast engine's forecast ten years on, against the latest count. Only names seen in
+        # the latest year get a ratio, and the engine only looks back over its own window for those
+        forecaster = FastForecaster()
+        tail = counts[:, -forecaster.window:]
+        observed = np.where(tail > 0, tail, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            future_mean = forecaster.forecast_matrix(years[-forecaster.window:], observed, self.horizon)[0]
+            ratio = np.where(latest > 0, future_mean[:, -1] / latest, np.nan)
+
+        return pd.DataFrame({
+            'Name': stats['Name'],
+            'Gender': self.genders,
+            'Latest': latest.astype(int),
+            'slope': slope,
+            'acceleration': acceleration,
+            'forecast_ratio': ratio,
+        })
+
+    def top(self, gender=None, n=20, by='slope', rising=True, min_count=MIN_COUNT):
+        """The n names rising (or falling) fastest by a metric.
+
+        slope is the average growth per year over the window in log space,
+        acceleration how fast that is changing, forecast_ratio the forecast
+        ten years on over the latest count.
+        """
+        order = self.order[by] if rising else self.order[by][::-1]
+        keep = self.metrics['Latest'].to_numpy()[order] >= min_count
+        if gender is not None:
+            keep &= self.genders[order] == gender
+        return self.metrics.iloc[order[keep][:n]].reset_index(drop=True)
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def trend_index(dataset):
+    # the shared index for a dataset, brought up to date from the last one built in this process
+    with _lock:
+        previous = _indexes.get(dataset.key)
+
+    index = previous.updated(dataset) if previous is not None else TrendIndex.build(dataset)
+
+    with _lock:
+        _indexes[dataset.key] = index
+    return index
+
+
+if __name__ == '__main__':
+    # python trends.py -> build and query times, and the top rising names in each dataset
+    parser = argparse.ArgumentParser(description='Build the trend index and show the fastest rising names.')
+    parser.add_argument('--by', default='slope', choices=METRICS)
+    parser.add_argument('--n', type=int, default=20)
+    args = parser.parse_args()
+
+    for key in names_data.DATASETS:
+        dataset = names_data.load_dataset(key)
+
+        start = time.perf_counter()
+        index = TrendIndex.build(dataset)
+        built = time.perf_counter() - start
+
+        # as if the latest year had just been ingested, which rebuilds the whole index
+        latest = int(index.years[-1])
+        stale = copy.copy(index)
+        stale.signatures = {year: s for year, s in index.signatures.items() if year != latest}
+        start = time.perf_counter()
+        stale.updated(dataset)
+        refreshed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        top = index.top('F', args.n, args.by)
+        query = time.perf_counter() - start
+
+        print(f'{key}: {len(index.metrics)} names x {len(index.years)} years, built in {built:.2f}s, '
+              f'rebuilt for a new year in {refreshed:.2f}s, top {args.n} in {1000 * query:.2f} ms')
+        print(top.to_string(index=False, float_format='%.3f'))